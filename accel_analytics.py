@@ -0,0 +1,140 @@
+import os
+import threading
+from collections import deque
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Fixed-size analysis windows, in samples, and the hop between them
+WINDOW_SAMPLES = int(os.getenv("ACCEL_WINDOW_SAMPLES", "256"))
+WINDOW_STEP = int(os.getenv("ACCEL_WINDOW_STEP", "128"))
+# Thresholds on acceleration magnitude, in g (a device at rest reads ~1 g)
+PEAK_G = float(os.getenv("ACCEL_PEAK_G", "1.5"))
+IMPACT_G = float(os.getenv("ACCEL_IMPACT_G", "3.0"))
+FREEFALL_G = float(os.getenv("ACCEL_FREEFALL_G", "0.35"))
+# Events kept in memory for the dashboard and the chat context
+MAX_EVENTS = int(os.getenv("ACCEL_MAX_EVENTS", "100"))
+
+
+def window_features(times, values, window=WINDOW_SAMPLES, step=WINDOW_STEP):
+    """Per-window features for (N,) times and (N, 3) values, all windows at once
+
+    Returns a dict of arrays with one entry per window: start/end time, RMS
+    per axis and of the magnitude, peak magnitude and its time, min magnitude,
+    count of peaks above PEAK_G and the dominant frequency in Hz.
+    """
+    if len(times) < window:
+        return None
+    # (W, window) views into the original arrays; nothing is copied until the math below
+    t = sliding_window_view(times, window)[::step]
+    v = sliding_window_view(values, window, axis=0)[::step]  # (W, 3, window)
+    magnitude = np.sqrt((v.astype(np.float64) ** 2).sum(axis=1))  # (W, window)
+
+    rows = np.arange(len(t))
+    peak_idx = magnitude.argmax(axis=1)
+
+    # Local maxima above the threshold, counted per window
+    mid = magnitude[:, 1:-1]
+    peaks = (mid > magnitude[:, :-2]) & (mid >= magnitude[:, 2:]) & (mid > PEAK_G)
+
+    # Dominant frequency of the magnitude with its mean (gravity) removed
+    sample_rate = 1.0 / np.median(np.diff(times)) if len(times) > 1 else 0.0
+    spectrum = np.abs(np.fft.rfft(magnitude - magnitude.mean(axis=1, keepdims=True), axis=1))
+    freqs = np.fft.rfftfreq(window, d=1.0 / sample_rate) if sample_rate > 0 else np.zeros(window // 2 + 1)
+    dominant_hz = freqs[spectrum[:, 1:].argmax(axis=1) + 1]
+
+    return {
+        'start': t[:, 0],
+        'end': t[:, -1],
+        'rms': np.sqrt((v.astype(np.float64) ** 2).mean(axis=2)),  # (W, 3)
+        'rms_magnitude': np.sqrt((magnitude ** 2).mean(axis=1)),
+        'peak_g': magnitude[rows, peak_idx],
+        'peak_time': t[rows, peak_idx],
+        'min_g': magnitude.min(axis=1),
+        'peak_count': peaks.sum(axis=1),
+        'dominant_hz': dominant_hz,
+    }
+
+
+def detect_events(features, device_id, previous=None):
+    """Impact and fall events from window features as compact dicts
+
+    An impact is a window whose peak exceeds IMPACT_G; a fall is an impact
+    in the same or the following window as free fall (magnitude under
+    FREEFALL_G). Overlapping windows flag the same spike, so only the first
+    of each run of flagged windows becomes an event. previous carries the
+    flags of the last window from an earlier call so runs continue across
+    calls; the flags of this call's last window are returned alongside the
+    events.
+    """
+    if features is None:
+        return [], previous
+    previous = previous or {'impact': False, 'fall': False, 'freefall': False}
+    impact = features['peak_g'] > IMPACT_G
+    freefall = features['min_g'] < FREEFALL_G
+    fall = impact & (freefall | np.concatenate([[previous['freefall']], freefall[:-1]]))
+    impact_only = impact & ~fall
+
+    events = []
+    for kind, flags in (('fall', fall), ('impact', impact_only)):
+        rising = flags & ~np.concatenate([[previous[kind]], flags[:-1]])
+        for i in np.flatnonzero(rising):
+            events.append({
+                'device': device_id,
+                'type': kind,
+                'time': float(features['peak_time'][i]),
+                'peak_g': round(float(features['peak_g'][i]), 2),
+                'dominant_hz': round(float(features['dominant_hz'][i]), 1),
+            })
+    events.sort(key=lambda e: e['time'])
+    return events, {'impact': bool(impact_only[-1]), 'fall': bool(fall[-1]), 'freefall': bool(freefall[-1])}
+
+
+def format_events(events):
+    """One short line per event for the chat system prompt"""
+    return [
+        f"{e['device']}: {e['type']} at t={e['time']:.1f}s, peak {e['peak_g']:.1f} g, "
+        f"dominant {e['dominant_hz']:.1f} Hz"
+        for e in events
+    ]
+
+
+class AccelMonitor:
+    """Runs the analytics over each device's ring buffer as new samples arrive
+
+    Only windows that haven't been analyzed yet are computed on each update,
+    and the event log is bounded.
+    """
+
+    def __init__(self, hub, window=WINDOW_SAMPLES, step=WINDOW_STEP, max_events=MAX_EVENTS):
+        self.hub = hub
+        self.window = window
+        self.step = step
+        self.events = deque(maxlen=max_events)
+        self.latest = {}       # device -> features of the newest window
+        self._next_start = {}  # device -> absolute sample index of the next window
+        self._flags = {}       # device -> event flags of the last window analyzed
+        self._lock = threading.Lock()
+
+    def update(self):
+        """Analyze new windows on every device; returns the events found"""
+        found = []
+        with self._lock:
+            for device_id in self.hub.devices():
+                times, values, first = self.hub.buffer(device_id).since(self._next_start.get(device_id, 0))
+                # Align to the window grid in case older samples were overwritten
+                skip = -first % self.step
+                features = window_features(times[skip:], values[skip:], self.window, self.step)
+                if features is None:
+                    continue
+                n_windows = len(features['start'])
+                self._next_start[device_id] = first + skip + n_windows * self.step
+                self.latest[device_id] = {key: value[-1] for key, value in features.items()}
+                events, self._flags[device_id] = detect_events(features, device_id, self._flags.get(device_id))
+                found.extend(events)
+            self.events.extend(found)
+        return found
+
+    def recent(self, limit=10):
+        with self._lock:
+            return list(self.events)[-limit:]
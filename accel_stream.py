@@ -0,0 +1,208 @@
+import os
+import socket
+import threading
+import time
+
+import numpy as np
+
+# Samples kept per device (e.g. 60 s at 500 Hz); memory is fixed at startup
+ACCEL_BUFFER_SAMPLES = int(os.getenv("ACCEL_BUFFER_SAMPLES", "30000"))
+ACCEL_MAX_DEVICES = int(os.getenv("ACCEL_MAX_DEVICES", "64"))
+# Where readings come from: udp://host:port or file:/path/to/log (unset = demo data)
+ACCEL_SOURCE = os.getenv("ACCEL_SOURCE", "")
+AXES = ['x', 'y', 'z']
+
+
+class RingBuffer:
+    """Fixed-size circular buffer of timestamped 3-axis samples"""
+
+    def __init__(self, capacity=ACCEL_BUFFER_SAMPLES, channels=len(AXES)):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros((capacity, channels), dtype=np.float32)
+        self.head = 0      # next write position
+        self.count = 0     # valid samples, up to capacity
+        self.total = 0     # samples ever written
+        self._lock = threading.Lock()
+
+    def extend(self, times, values):
+        """Append a batch of samples, overwriting the oldest once full"""
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float32)
+        if len(times) > self.capacity:
+            times, values = times[-self.capacity:], values[-self.capacity:]
+        n = len(times)
+        if n == 0:
+            return
+        with self._lock:
+            first = min(n, self.capacity - self.head)
+            self.times[self.head:self.head + first] = times[:first]
+            self.values[self.head:self.head + first] = values[:first]
+            if n > first:
+                self.times[:n - first] = times[first:]
+                self.values[:n - first] = values[first:]
+            self.head = (self.head + n) % self.capacity
+            self.count = min(self.capacity, self.count + n)
+            self.total += n
+
+    def snapshot(self, last=None):
+        """Copy of the newest samples in time order as (times, values)"""
+        with self._lock:
+            n = self.count if last is None else min(last, self.count)
+            idx = (self.head - n + np.arange(n)) % self.capacity
+            return self.times[idx], self.values[idx]
+
+    def since(self, start):
+        """Samples from absolute index start onward (or the oldest still held)
+
+        Returns (times, values, first) where first is the absolute index of
+        the first sample returned.
+        """
+        with self._lock:
+            first = max(start, self.total - self.count)
+            n = max(0, self.total - first)
+            idx = (self.head - n + np.arange(n)) % self.capacity
+            return self.times[idx], self.values[idx], first
+
+
+class AccelerometerHub:
+    """Per-device ring buffers, with a hard cap on the number of devices"""
+
+    def __init__(self, capacity=ACCEL_BUFFER_SAMPLES, max_devices=ACCEL_MAX_DEVICES):
+        self.capacity = capacity
+        self.max_devices = max_devices
+        self.buffers = {}
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def buffer(self, device_id):
+        with self._lock:
+            if device_id not in self.buffers:
+                if len(self.buffers) >= self.max_devices:
+                    return None
+                self.buffers[device_id] = RingBuffer(self.capacity)
+            return self.buffers[device_id]
+
+    def devices(self):
+        with self._lock:
+            return sorted(self.buffers)
+
+    def ingest_lines(self, lines):
+        """Parse "device,timestamp,x,y,z" lines and append them per device in batches"""
+        batches = {}
+        for line in lines:
+            parts = line.strip().split(',')
+            if len(parts) != 5:
+                continue
+            try:
+                sample = [float(p) for p in parts[1:]]
+            except ValueError:
+                continue
+            batches.setdefault(parts[0], []).append(sample)
+
+        for device_id, samples in batches.items():
+            buf = self.buffer(device_id)
+            if buf is None:
+                self.dropped += len(samples)
+                continue
+            samples = np.array(samples)
+            buf.extend(samples[:, 0], samples[:, 1:])
+
+
+def tail_file(hub, path, stop, poll_interval=0.1):
+    """Follow a growing log file (like tail -f) and feed complete lines to the hub"""
+    while not os.path.exists(path) and not stop.is_set():
+        time.sleep(poll_interval)
+    with open(path) as f:
+        f.seek(0, os.SEEK_END)
+        partial = ''
+        while not stop.is_set():
+            chunk = f.read(1 << 16)
+            if not chunk:
+                time.sleep(poll_interval)
+                continue
+            lines = (partial + chunk).split('\n')
+            partial = lines.pop()
+            hub.ingest_lines(lines)
+
+
+def serve_udp(hub, host, port, stop):
+    """Receive datagrams of newline-separated readings on a local UDP socket"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((host, port))
+    sock.settimeout(0.5)
+    try:
+        while not stop.is_set():
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                continue
+            hub.ingest_lines(data.decode('utf-8', errors='ignore').splitlines())
+    finally:
+        sock.close()
+
+
+def start_ingest(hub, source=ACCEL_SOURCE):
+    """Start a background reader for udp://host:port or file:/path; returns its stop event"""
+    stop = threading.Event()
+    if source.startswith('udp://'):
+        host, port = source[len('udp://'):].rsplit(':', 1)
+        target, args = serve_udp, (hub, host, int(port), stop)
+    elif source.startswith('file:'):
+        target, args = tail_file, (hub, source[len('file:'):], stop)
+    else:
+        raise ValueError(f"Unsupported accelerometer source: {source}")
+    threading.Thread(target=target, args=args, name='accel-ingest', daemon=True).start()
+    return stop
+
+
+def minmax_downsample(times, values, n_bins):
+    """Keep the min and max of each bin so spikes survive downsampling (values is 1-D)
+
+    Bins are as even as possible and cover every sample; the newest sample is
+    always kept so the chart reaches the present.
+    """
+    n = len(times)
+    if n <= 2 * n_bins:
+        return times, values
+    starts = np.linspace(0, n, n_bins + 1).astype(int)[:-1]
+    bins = np.repeat(np.arange(n_bins), np.diff(np.append(starts, n)))
+    positions = np.arange(n)
+
+    # First position of each bin's min and max
+    lo_values = np.minimum.reduceat(values, starts)
+    hi_values = np.maximum.reduceat(values, starts)
+    lo = np.minimum.reduceat(np.where(values == lo_values[bins], positions, n), starts)
+    hi = np.minimum.reduceat(np.where(values == hi_values[bins], positions, n), starts)
+    # A NaN in a bin matches nothing; fall back to the bin's first sample
+    lo, hi = np.where(lo < n, lo, starts), np.where(hi < n, hi, starts)
+
+    # Emit each bin's two points in time order
+    keep = np.column_stack([np.minimum(lo, hi), np.maximum(lo, hi)]).ravel()
+    if keep[-1] != n - 1:
+        keep = np.append(keep, n - 1)
+    return times[keep], values[keep]
+
+
+def lttb(times, values, n_out):
+    """Largest-Triangle-Three-Buckets downsampling to n_out points (values is 1-D)"""
+    n = len(times)
+    if n_out >= n or n_out < 3:
+        return times, values
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    keep = np.empty(n_out, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket is the third triangle vertex
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_t = times[end:next_end].mean() if next_end > end else times[-1]
+        avg_v = values[end:next_end].mean() if next_end > end else values[-1]
+        bucket_t, bucket_v = times[start:end], values[start:end]
+        area = np.abs((times[prev] - avg_t) * (bucket_v - values[prev])
+                      - (times[prev] - bucket_t) * (avg_v - values[prev]))
+        prev = start + int(area.argmax())
+        keep[i + 1] = prev
+    return times[keep], values[keep]
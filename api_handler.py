@@ -1,10 +1,46 @@
+import asyncio
+import hashlib
+import json
 import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from dotenv import load_dotenv
-from huggingface_hub import InferenceClient
+import clients
+import llm_backends
+import perf
 
 # Load environment variables at the start
 load_dotenv()
 
+# Maximum simultaneous LLM requests per process (set LLM_MAX_CONCURRENCY)
+LLM_MAX_CONCURRENCY = llm_backends.LLM_MAX_CONCURRENCY
+# Prompt size budget in (estimated) tokens, leaving room for the response
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+# Cached responses for identical prompts (seed is pinned, so output is deterministic)
+RESPONSE_CACHE_ENABLED = os.getenv("LLM_RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_SIZE = int(os.getenv("LLM_RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_TTL = float(os.getenv("LLM_RESPONSE_CACHE_TTL", "3600"))
+# Backends to try, in order of preference: hf (hosted), openai (local server), llama (in-process GGUF)
+LLM_BACKENDS = [name.strip() for name in os.getenv("LLM_BACKENDS", "hf,openai,llama").split(",") if name.strip()]
+# Seconds a backend gets for a full response, and for the first streamed token, before falling back
+LLM_TIMEOUT_BUDGET = float(os.getenv("LLM_TIMEOUT_BUDGET", "20"))
+LLM_FIRST_TOKEN_BUDGET = float(os.getenv("LLM_FIRST_TOKEN_BUDGET", "8"))
+# Seconds a failed backend is moved to the back of the chain
+LLM_BACKEND_COOLDOWN = float(os.getenv("LLM_BACKEND_COOLDOWN", "60"))
+# Prompts per backend request in batch_ai_responses
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "8"))
+NO_BACKEND_MESSAGE = "No LLM backend available (set HF_API_TOKEN, LOCAL_LLM_URL or LLAMA_MODEL_PATH)"
+
+_DONE = object()
+_loop = None
+_loop_lock = threading.Lock()
+_semaphore = None
+_slot_lock = None
+_session_requests = {}
+
 def format_prompt(messages):
     """Format messages into a prompt that instruction-following models can understand"""
     formatted_prompt = ""
@@ -25,38 +61,539 @@ def format_prompt(messages):
     
     return formatted_prompt
 
-def get_ai_response(messages, temperature=0.7, max_tokens=512):
-    # Get API token
-    api_token = os.getenv("HF_API_TOKEN")
-    if not api_token:
-        return "Error: HF_API_TOKEN not found in environment variables"
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) without loading a tokenizer"""
+    return len(text) // 4 + 1
+
+class PromptContext:
+    """Token-budgeted prompt builder that formats each turn only once
+
+    Keeps the system message, appends new turns to a cached prefix, and when
+    the budget is exceeded drops the oldest turns in favour of a short summary
+    line. Keep one instance per conversation (e.g. in session state).
+    """
     
-    # Initialize client
-    client = InferenceClient(
-        token=api_token,
-        timeout=30  # Increase timeout for longer responses
-    )
+    SUMMARY_TOPICS = 5
+    
+    def __init__(self, budget=PROMPT_TOKEN_BUDGET):
+        self.budget = budget
+        self.reset()
+    
+    def reset(self, system=None):
+        self.system = system
+        self.turns = []        # (formatted text, estimated tokens) per kept turn
+        self.tokens = 0
+        self.seen = 0          # number of non-system messages already appended
+        self.last_seen = None
+        self.dropped = 0
+        self.topics = []       # snippets of dropped user questions
+        self.prefix = None
+    
+    def _header(self):
+        header = f"<|system|>{self.system}\n" if self.system else ""
+        if self.dropped:
+            header += (
+                f"<|system|>Summary of {self.dropped} earlier messages omitted for length. "
+                f"Earlier questions: {'; '.join(self.topics)}\n"
+            )
+        return header
+    
+    def _drop_oldest(self):
+        """Drop turns down to 3/4 of the budget so a rebuild isn't needed every turn"""
+        target = self.budget * 3 // 4
+        while len(self.turns) > 1 and estimate_tokens(self._header()) + self.tokens > target:
+            text, tokens = self.turns.pop(0)
+            self.tokens -= tokens
+            self.dropped += 1
+            if text.startswith("<|user|>"):
+                snippet = text[len("<|user|>"):].strip()
+                self.topics = (self.topics + [snippet[:60]])[-self.SUMMARY_TOPICS:]
+        self.prefix = self._header() + "".join(text for text, _ in self.turns)
+    
+    def build(self, messages):
+        """Formatted prompt for messages, reusing the cached prefix when only new turns were added"""
+        system = next((msg["content"] for msg in messages if msg["role"] == "system"), None)
+        history = [msg for msg in messages if msg["role"] != "system"]
+        
+        # Start over if the system context changed or the history was rewritten
+        if system != self.system or len(history) < self.seen or (
+                self.seen and (history[self.seen - 1]["role"], history[self.seen - 1]["content"]) != self.last_seen):
+            self.reset(system)
+        if self.prefix is None:
+            self.prefix = self._header()
+        
+        for message in history[self.seen:]:
+            role = "assistant" if message["role"] == "assistant" else "user"
+            text = f"<|{role}|>{message['content']}\n"
+            tokens = estimate_tokens(text)
+            self.turns.append((text, tokens))
+            self.tokens += tokens
+            self.prefix += text
+        if history:
+            self.seen = len(history)
+            self.last_seen = (history[-1]["role"], history[-1]["content"])
+        
+        if estimate_tokens(self.prefix) > self.budget:
+            self._drop_oldest()
+        
+        return self.prefix + "<|assistant|>"
+
+def build_prompt(messages, prompt_context=None):
+    """Use the conversation's PromptContext if given, otherwise format the full history"""
+    if prompt_context is not None:
+        return prompt_context.build(messages)
+    return format_prompt(messages)
+
+def generation_params(temperature=0.7, max_tokens=512):
+    """Sampling parameters shared by the streaming and non-streaming calls"""
+    return {
+        'model': clients.hf_model(),  # Set HF_MODEL to change the model
+        'max_new_tokens': max_tokens,  # Maximum length of response
+        'temperature': temperature,    # Controls randomness (0.0-1.0)
+        'top_p': 0.95,                 # Nucleus sampling
+        'repetition_penalty': 1.1,     # Prevent repetitive text
+        'do_sample': True,             # Enable sampling
+        'seed': 42                     # For reproducibility
+    }
+
+class ResponseCache:
+    """Thread-safe LRU of model responses with TTL expiry"""
+    
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
     
+    @staticmethod
+    def key(prompt, params):
+        """Hash of the prompt, model and every sampling parameter that affects output"""
+        payload = json.dumps({'prompt': prompt, **params}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def set(self, key, response):
+        with self._lock:
+            self._entries[key] = (response, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
+
+response_cache = ResponseCache()
+perf.register_cache('llm_responses', response_cache.stats)
+
+class BackendHealth:
+    """Latency and failure tracking that decides the order backends are tried in
+
+    Backends that failed recently (within LLM_BACKEND_COOLDOWN) or whose
+    typical latency exceeds the timeout budget move to the back of the chain
+    but stay available as a last resort.
+    """
+    
+    def __init__(self, budget=LLM_TIMEOUT_BUDGET, cooldown=LLM_BACKEND_COOLDOWN):
+        self.budget_ms = budget * 1000
+        self.cooldown = cooldown
+        self._stats = {}
+        self._lock = threading.Lock()
+    
+    def _entry(self, name):
+        return self._stats.setdefault(name, {'ok': 0, 'failures': 0, 'ewma_ms': None, 'down_until': 0.0,
+                                             'last_error': None})
+    
+    def record_success(self, name, ms):
+        with self._lock:
+            entry = self._entry(name)
+            entry['ok'] += 1
+            entry['ewma_ms'] = ms if entry['ewma_ms'] is None else 0.8 * entry['ewma_ms'] + 0.2 * ms
+            entry['down_until'] = 0.0
+    
+    def record_failure(self, name, error):
+        with self._lock:
+            entry = self._entry(name)
+            entry['failures'] += 1
+            entry['last_error'] = str(error)[:200]
+            entry['down_until'] = time.monotonic() + self.cooldown
+    
+    def order(self, backends):
+        """Healthy backends in configured order, then slow ones, then recently failed ones"""
+        now = time.monotonic()
+        with self._lock:
+            def rank(backend):
+                entry = self._entry(backend.name)
+                if entry['down_until'] > now:
+                    return 2
+                if entry['ewma_ms'] is not None and entry['ewma_ms'] > self.budget_ms:
+                    return 1
+                return 0
+            return sorted(backends, key=rank)
+    
+    def stats(self):
+        with self._lock:
+            return {name: dict(entry) for name, entry in self._stats.items()}
+
+backend_health = BackendHealth()
+_backends = {}
+_backends_lock = threading.Lock()
+# Runs blocking backend calls so a timeout budget can be enforced on them
+_call_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix='llm-call')
+
+def get_backends():
+    """Configured backends that can run here (credentials, server URL or model file present), in LLM_BACKENDS order"""
+    with _backends_lock:
+        for name in LLM_BACKENDS:
+            if name not in _backends and name in llm_backends.BACKENDS:
+                _backends[name] = llm_backends.BACKENDS[name]()
+        return [_backends[name] for name in LLM_BACKENDS if name in _backends and _backends[name].available()]
+
+def warm_backends(background=True):
+    """Load models / open connections for every available backend ahead of the first question"""
+    def warm(backend):
+        try:
+            with perf.span('llm.warm', backend=backend.name):
+                backend.warm()
+        except Exception as e:
+            backend_health.record_failure(backend.name, e)
+    
+    threads = [threading.Thread(target=warm, args=(backend,), name=f'llm-warm-{backend.name}', daemon=True)
+               for backend in get_backends()]
+    for thread in threads:
+        thread.start()
+    if not background:
+        for thread in threads:
+            thread.join()
+    return threads
+
+def _cache_key(prompt, params, backend):
+    """Response cache key for an answer from backend, whose model may not be the hosted one"""
+    return ResponseCache.key(prompt, {**params, 'model': backend.model_id()})
+
+def _submit_bounded(func, args, slots=1):
+    """Run func on _call_executor holding slots of the LLM_MAX_CONCURRENCY limit
+
+    The slots are taken on the background loop, so blocking calls share the
+    limit with streams, and released only when func returns, even if the
+    caller stopped waiting for it.
+    """
+    loop = _background_loop()
+    asyncio.run_coroutine_threadsafe(_acquire_slots(slots), loop).result()
+    
+    def release(_):
+        for _ in range(slots):
+            loop.call_soon_threadsafe(_semaphore.release)
+    
+    try:
+        future = _call_executor.submit(func, *args)
+    except BaseException:
+        release(None)
+        raise
+    future.add_done_callback(release)
+    return future
+
+def _call_with_fallback(method, args, budget):
+    """Call method on each backend in health order until one answers within budget seconds
+
+    Returns (result, backend).
+    """
+    backends = backend_health.order(get_backends())
+    if not backends:
+        raise RuntimeError(NO_BACKEND_MESSAGE)
+    errors = []
+    for backend in backends:
+        slots = backend.batch_requests(len(args[0])) if method == 'generate_batch' else 1
+        future = _submit_bounded(getattr(backend, method), args, slots)
+        start = time.perf_counter()
+        try:
+            result = future.result(timeout=budget)
+        except FutureTimeoutError:
+            # The call keeps running (and holding its slots); its result is ignored
+            error = f"timed out after {budget:g}s"
+        except Exception as e:
+            error = str(e)
+        else:
+            backend_health.record_success(backend.name, (time.perf_counter() - start) * 1000)
+            return result, backend
+        backend_health.record_failure(backend.name, error)
+        errors.append(f"{backend.name}: {error}")
+    raise RuntimeError("; ".join(errors))
+
+def get_ai_response(messages, temperature=0.7, max_tokens=512, prompt_context=None, use_cache=True):
     try:
         # Format the conversation
-        prompt = format_prompt(messages)
-        
-        # Make the API call
-        response = client.text_generation(
-            model="mistralai/Mistral-7B-Instruct-v0.2",  # You can change the model
-            prompt=prompt,
-            max_new_tokens=max_tokens,        # Maximum length of response
-            temperature=temperature,           # Controls randomness (0.0-1.0)
-            top_p=0.95,               # Nucleus sampling
-            repetition_penalty=1.1,    # Prevent repetitive text
-            do_sample=True,           # Enable sampling
-            seed=42                    # For reproducibility
-        )
+        prompt = build_prompt(messages, prompt_context)
+        params = generation_params(temperature, max_tokens)
+        
+        # Only answers from the backend that would be asked first are served from cache
+        use_cache = use_cache and RESPONSE_CACHE_ENABLED
+        backends = backend_health.order(get_backends())
+        if use_cache and backends:
+            cached = response_cache.get(_cache_key(prompt, params, backends[0]))
+            if cached is not None:
+                return cached
+        
+        # First backend to answer within the budget wins
+        with perf.span('llm.response', model=params['model']) as tags:
+            response, backend = _call_with_fallback('generate', (prompt, params), LLM_TIMEOUT_BUDGET)
+            tags['backend'] = backend.name
         
         # Clean up response if needed
         cleaned_response = response.strip()
         
+        if use_cache:
+            response_cache.set(_cache_key(prompt, params, backend), cleaned_response)
         return cleaned_response
         
     except Exception as e:
-        return f"Error: {str(e)}" 
\ No newline at end of file
+        return f"Error: {str(e)}"
+
+def batch_ai_responses(conversations, temperature=0.7, max_tokens=512, use_cache=True):
+    """Answer several conversations, sending uncached prompts to the backend in batches of LLM_BATCH_SIZE
+
+    Returns one response (or "Error: ..." string) per conversation, in order.
+    """
+    params = generation_params(temperature, max_tokens)
+    use_cache = use_cache and RESPONSE_CACHE_ENABLED
+    prompts = [format_prompt(messages) for messages in conversations]
+    backends = backend_health.order(get_backends())
+    use_cache = use_cache and bool(backends)
+    
+    responses = [response_cache.get(_cache_key(prompt, params, backends[0])) if use_cache else None
+                 for prompt in prompts]
+    pending = [i for i, response in enumerate(responses) if response is None]
+    for start in range(0, len(pending), LLM_BATCH_SIZE):
+        batch = pending[start:start + LLM_BATCH_SIZE]
+        try:
+            with perf.span('llm.batch', model=params['model'], size=len(batch)) as tags:
+                texts, backend = _call_with_fallback(
+                    'generate_batch', ([prompts[i] for i in batch], params), LLM_TIMEOUT_BUDGET * len(batch)
+                )
+                tags['backend'] = backend.name
+        except Exception as e:
+            texts = None
+            error = f"Error: {str(e)}"
+        for position, i in enumerate(batch):
+            if texts is None:
+                responses[i] = error
+                continue
+            responses[i] = texts[position].strip()
+            if use_cache:
+                response_cache.set(_cache_key(prompts[i], params, backend), responses[i])
+    return responses
+
+def _background_loop():
+    """Process-wide event loop that runs every async LLM request"""
+    global _loop, _semaphore, _slot_lock
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='llm-loop', daemon=True).start()
+            _semaphore, _slot_lock = asyncio.run_coroutine_threadsafe(_make_limits(), loop).result()
+            _loop = loop
+        return _loop
+
+async def _make_limits():
+    return asyncio.Semaphore(LLM_MAX_CONCURRENCY), asyncio.Lock()
+
+async def _acquire_slots(slots):
+    """Take slots of the concurrency limit; multi-slot takers go one at a time so two can't deadlock"""
+    if slots == 1:
+        await _semaphore.acquire()
+        return
+    async with _slot_lock:
+        for _ in range(slots):
+            await _semaphore.acquire()
+
+async def _first_token(stream):
+    """First non-blank token with leading whitespace dropped (matching the non-streaming strip()), or """""
+    async for token in stream:
+        token = token.lstrip()
+        if token:
+            return token
+    return ""
+
+async def _produce_tokens(prompt, temperature, max_tokens, emit, use_cache=True):
+    """Stream tokens from the model into emit(), always finishing with _DONE"""
+    try:
+        params = generation_params(temperature, max_tokens)
+        use_cache = use_cache and RESPONSE_CACHE_ENABLED
+        preferred = backend_health.order(get_backends())
+        if use_cache and preferred:
+            cached = response_cache.get(_cache_key(prompt, params, preferred[0]))
+            if cached is not None:
+                # Serve the whole cached answer as a single chunk
+                emit(cached)
+                return
+        
+        async with _semaphore:
+            backends = backend_health.order(get_backends())
+            if not backends:
+                emit(f"Error: {NO_BACKEND_MESSAGE}")
+                return
+            
+            errors = []
+            for backend in backends:
+                with perf.span('llm.stream', model=params['model'], backend=backend.name) as tags:
+                    stream_start = time.perf_counter()
+                    stream = backend.stream(prompt, params)
+                    # Until the first token arrives we can still fall back to the next backend
+                    try:
+                        first = await asyncio.wait_for(_first_token(stream), LLM_FIRST_TOKEN_BUDGET)
+                    except asyncio.CancelledError:
+                        await stream.aclose()
+                        raise
+                    except Exception as e:
+                        await stream.aclose()
+                        error = f"no first token within {LLM_FIRST_TOKEN_BUDGET:g}s" \
+                            if isinstance(e, asyncio.TimeoutError) else str(e)
+                        backend_health.record_failure(backend.name, error)
+                        errors.append(f"{backend.name}: {error}")
+                        tags['fallback'] = True
+                        continue
+                    tags['first_token_ms'] = round((time.perf_counter() - stream_start) * 1000, 2)
+                    
+                    chunks = [first] if first else []
+                    if first:
+                        emit(first)
+                    try:
+                        async for token in stream:
+                            chunks.append(token)
+                            emit(token)
+                    except Exception as e:
+                        # Part of the answer is already shown, so report rather than switch models
+                        backend_health.record_failure(backend.name, e)
+                        raise
+                    tags['chunks'] = len(chunks)
+                    backend_health.record_success(backend.name, (time.perf_counter() - stream_start) * 1000)
+                
+                # Only complete, error-free responses reach this point
+                if use_cache and chunks:
+                    response_cache.set(_cache_key(prompt, params, backend), "".join(chunks).strip())
+                return
+            
+            emit(f"Error: {'; '.join(errors)}")
+    
+    except asyncio.CancelledError:
+        emit("Error: Request cancelled")
+        raise
+    except Exception as e:
+        emit(f"Error: {str(e)}")
+    finally:
+        emit(_DONE)
+
+def _submit(prompt, temperature, max_tokens, emit, session_id, use_cache=True):
+    """Schedule a request on the background loop, cancelling the session's previous one"""
+    future = asyncio.run_coroutine_threadsafe(
+        _produce_tokens(prompt, temperature, max_tokens, emit, use_cache), _background_loop()
+    )
+    if session_id is not None:
+        with _loop_lock:
+            previous = _session_requests.get(session_id)
+            _session_requests[session_id] = future
+        if previous is not None:
+            previous.cancel()
+        future.add_done_callback(lambda f: _forget(session_id, f))
+    return future
+
+def _forget(session_id, future):
+    with _loop_lock:
+        if _session_requests.get(session_id) is future:
+            del _session_requests[session_id]
+
+def cancel_session(session_id):
+    """Cancel the in-flight request for a chat session, if any"""
+    with _loop_lock:
+        future = _session_requests.pop(session_id, None)
+    if future is not None:
+        future.cancel()
+
+def stream_ai_response(messages, temperature=0.7, max_tokens=512, session_id=None, prompt_context=None,
+                       use_cache=True):
+    """Yield response tokens as the model generates them
+
+    Errors are yielded in-band as a chunk starting with "Error:" so the caller
+    can tell a failed request (first chunk is the error) from one that broke
+    mid-stream (error follows the partial text). Starting a new request with
+    the same session_id cancels the previous one. Cached answers arrive as one chunk.
+    """
+    tokens = queue.Queue()
+    future = _submit(
+        build_prompt(messages, prompt_context), temperature, max_tokens, tokens.put, session_id, use_cache
+    )
+    try:
+        while True:
+            token = tokens.get()
+            if token is _DONE:
+                return
+            yield token
+    finally:
+        # Stop generating if the consumer went away early
+        future.cancel()
+
+async def astream_ai_response(messages, temperature=0.7, max_tokens=512, session_id=None, prompt_context=None,
+                              use_cache=True):
+    """Async generator version of stream_ai_response for use inside an event loop"""
+    tokens = asyncio.Queue()
+    caller_loop = asyncio.get_running_loop()
+    
+    def emit(token):
+        try:
+            caller_loop.call_soon_threadsafe(tokens.put_nowait, token)
+        except RuntimeError:
+            # Caller's loop already closed; nobody is listening
+            pass
+    
+    future = _submit(
+        build_prompt(messages, prompt_context), temperature, max_tokens, emit, session_id, use_cache
+    )
+    try:
+        while True:
+            token = await tokens.get()
+            if token is _DONE:
+                return
+            yield token
+    finally:
+        future.cancel()
+
+async def aget_ai_response(messages, temperature=0.7, max_tokens=512, session_id=None, prompt_context=None,
+                           use_cache=True):
+    """Complete response as a string, or an "Error: ..." message, without blocking the loop"""
+    chunks = []
+    async for token in astream_ai_response(messages, temperature, max_tokens, session_id, prompt_context,
+                                           use_cache):
+        if token.startswith("Error:"):
+            return token
+        chunks.append(token)
+    return "".join(chunks).strip()
+
+async def abatch_ai_responses(conversations, temperature=0.7, max_tokens=512, use_cache=True):
+    """batch_ai_responses without blocking the caller's event loop"""
+    return await asyncio.get_running_loop().run_in_executor(
+        None, batch_ai_responses, conversations, temperature, max_tokens, use_cache
+    )
@@ -0,0 +1,237 @@
+"""Headless pre-incident planning for many addresses.
+
+Reads addresses (or lat/lng pairs) from CSV or JSONL, runs geocoding,
+candidate search, routing and the flow-rate calculation on a worker pool,
+and streams one result per input record to JSONL or Parquet. Finished
+record ids go to a checkpoint file so an interrupted run can be resumed by
+running the same command again.
+
+    python batch_plan.py premises.csv plan.jsonl --workers 8
+    python batch_plan.py premises.jsonl plan_parquet/ --format parquet
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import clients
+import geocoding
+import isochrone_index
+import pipeline
+import water_data
+import water_index
+
+
+def read_records(path):
+    """Yield (record_id, record dict) from a CSV or JSONL file"""
+    with open(path, newline='') as f:
+        if path.lower().endswith('.csv'):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for line_number, record in enumerate(rows, 1):
+            record_id = record.get('id') or record.get('request_id') or str(line_number)
+            yield str(record_id), record
+
+
+def record_location(record):
+    """(address, lat, lng) from a record with either coordinates or an address"""
+    lat = record.get('lat', record.get('latitude'))
+    lng = record.get('lng', record.get('lon', record.get('longitude')))
+    address = record.get('address')
+    if lat not in (None, '') and lng not in (None, ''):
+        return address, float(lat), float(lng)
+    if not address:
+        raise ValueError("record has neither an address nor lat/lng")
+    g = geocoding.geocode_address(address)
+    if not g.ok:
+        raise ValueError(f"could not geocode address: {address}")
+    return g.address or address, g.lat, g.lng
+
+
+def plan_record(planner, record_id, record, tank_capacity, fill_time, top_n):
+    """Full pipeline for one record; failures are reported in the result instead of raised"""
+    result = {'id': record_id, 'address': record.get('address'), 'lat': None, 'lng': None,
+              'status': 'ok', 'error': None, 'best_source': None, 'best_source_type': None,
+              'best_flow_rate_gpm': None, 'best_round_trip_min': None, 'best_distance_miles': None,
+              'sources': '[]'}
+    try:
+        address, lat, lng = record_location(record)
+        result.update(address=address, lat=lat, lng=lng)
+
+        gdf, index, isochrones = planner
+        candidates = pipeline.find_candidates(gdf, index, isochrones, lng, lat)
+        centroids, routes, errors = pipeline.route_candidates(
+            clients.get_ors_client(), lng, lat, candidates, top_n=top_n
+        )
+        metrics = pipeline.supply_metrics_for(candidates, centroids, routes, tank_capacity, fill_time)
+
+        if not metrics:
+            result.update(status='no_route', error='; '.join(sorted(set(errors.values()))) or None)
+            return result
+
+        best = metrics[0]
+        result.update(
+            best_source=best['row']['NAME'],
+            best_source_type=best['row']['FTYPE'],
+            best_flow_rate_gpm=float(best['max_flow_rate']),
+            best_round_trip_min=float(best['round_trip']),
+            best_distance_miles=float(best['distance']),
+            sources=json.dumps([{
+                'name': m['row']['NAME'],
+                'type': m['row']['FTYPE'],
+                'lat': m['centroid'].y,
+                'lng': m['centroid'].x,
+                'distance_miles': float(m['distance']),
+                'round_trip_min': float(m['round_trip']),
+                'flow_rate_gpm': float(m['max_flow_rate']),
+            } for m in metrics]),
+        )
+    except Exception as e:
+        result.update(status='error', error=str(e))
+    return result
+
+
+class JsonlWriter:
+    """Appends results to a JSONL file, flushing after every record
+
+    write() and close() return the ids that are now safely on disk.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'a')
+
+    def write(self, result):
+        self.file.write(json.dumps(result) + '\n')
+        self.file.flush()
+        return [result['id']]
+
+    def close(self):
+        self.file.close()
+        return []
+
+
+class ParquetWriter:
+    """Buffers results and writes them as numbered part files inside a directory
+
+    Each run appends new parts, so resuming never rewrites earlier output.
+    """
+
+    def __init__(self, directory, flush_every=1000):
+        import pyarrow as pa  # fails early if the optional dependency is missing
+
+        # One fixed schema for every part, so parts where a column happens to be
+        # all None still read back as a single dataset
+        self.schema = pa.schema([
+            ('id', pa.string()),
+            ('address', pa.string()),
+            ('lat', pa.float64()),
+            ('lng', pa.float64()),
+            ('status', pa.string()),
+            ('error', pa.string()),
+            ('best_source', pa.string()),
+            ('best_source_type', pa.string()),
+            ('best_flow_rate_gpm', pa.float64()),
+            ('best_round_trip_min', pa.float64()),
+            ('best_distance_miles', pa.float64()),
+            ('sources', pa.string()),
+        ])
+        self.directory = directory
+        self.flush_every = flush_every
+        self.buffer = []
+        os.makedirs(directory, exist_ok=True)
+        self.part = len([name for name in os.listdir(directory) if name.endswith('.parquet')])
+
+    def write(self, result):
+        self.buffer.append(result)
+        if len(self.buffer) >= self.flush_every:
+            return self.flush()
+        return []
+
+    def flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self.buffer:
+            return []
+        path = os.path.join(self.directory, f"part-{self.part:05d}.parquet")
+        pq.write_table(pa.Table.from_pylist(self.buffer, schema=self.schema), f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+        written = [result['id'] for result in self.buffer]
+        self.part += 1
+        self.buffer = []
+        return written
+
+    def close(self):
+        return self.flush()
+
+
+def run(input_path, output_path, fmt=None, workers=4, tank_capacity=3000, fill_time=15,
+        top_n=1, flush_every=1000, checkpoint_path=None):
+    """Plan every record not already listed in the checkpoint; returns the number planned"""
+    fmt = fmt or ('parquet' if output_path.endswith(('.parquet', '/')) or os.path.isdir(output_path) else 'jsonl')
+    checkpoint_path = checkpoint_path or output_path.rstrip('/') + '.checkpoint'
+
+    done = set()
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            done = {line.strip() for line in f if line.strip()}
+
+    # Shared read-only data, loaded once for every worker
+    source_hash = water_data.file_hash(water_data.SOURCE_PATH)
+    gdf = water_data.load_water_bodies()
+    index = water_index.WaterBodyIndex(gdf)
+    planner = (index.gdf, index, isochrone_index.load_or_build(index, source_hash))
+
+    writer = ParquetWriter(output_path, flush_every) if fmt == 'parquet' else JsonlWriter(output_path)
+    planned = 0
+
+    with open(checkpoint_path, 'a') as checkpoint, ThreadPoolExecutor(max_workers=workers) as pool:
+        def checkpoint_ids(ids):
+            # Only ids whose results are durable on disk are marked done
+            if ids:
+                checkpoint.write(''.join(f"{record_id}\n" for record_id in ids))
+                checkpoint.flush()
+
+        in_flight = set()
+        for record_id, record in read_records(input_path):
+            if record_id in done:
+                continue
+            in_flight.add(pool.submit(plan_record, planner, record_id, record, tank_capacity, fill_time, top_n))
+            # Bound the queue so huge inputs aren't read into memory all at once
+            if len(in_flight) >= workers * 4:
+                finished = next(as_completed(in_flight))
+                in_flight.remove(finished)
+                checkpoint_ids(writer.write(finished.result()))
+                planned += 1
+        for finished in as_completed(in_flight):
+            checkpoint_ids(writer.write(finished.result()))
+            planned += 1
+
+        checkpoint_ids(writer.close())
+
+    return planned
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-plan water supply for many addresses")
+    parser.add_argument('input', help="CSV or JSONL with an address or lat/lng per record")
+    parser.add_argument('output', help="JSONL file, or a directory for Parquet part files")
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], help="Output format (default: from output path)")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--tank-capacity', type=float, default=3000, help="Gallons")
+    parser.add_argument('--fill-time', type=float, default=15, help="Minutes")
+    parser.add_argument('--top-n', type=int, default=1, help="Candidates to fetch full route geometry for")
+    parser.add_argument('--flush-every', type=int, default=1000, help="Rows per Parquet part file")
+    parser.add_argument('--checkpoint', help="Checkpoint file (default: <output>.checkpoint)")
+    args = parser.parse_args(argv)
+
+    planned = run(args.input, args.output, args.format, args.workers, args.tank_capacity,
+                  args.fill_time, args.top_n, args.flush_every, args.checkpoint)
+    print(f"Planned {planned} records", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+"""Offline benchmarks for the geo and LLM hot paths.
+
+Runs against local stand-ins for OpenRouteService, Nominatim, a Hugging
+Face text-generation endpoint and a local OpenAI-compatible server (each
+with configurable latency), so results are reproducible without network
+access or API keys. Results are written as JSON for tracking regressions
+between commits.
+
+    python bench.py                              # everything, default sizes
+    python bench.py --only nearest --scales 1 4 16
+    python bench.py --ors-latency-ms 150 --llm-latency-ms 400 --output results.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+BENCHMARKS = ['dataset', 'nearest', 'prompt', 'end_to_end']
+# Area the mock geocoder places addresses in (around Chapel Hill, NC)
+MOCK_CENTER = (35.9132, -79.0558)
+MOCK_SPREAD_DEG = 0.3
+
+
+def latency_stats(samples_ms):
+    samples = np.asarray(samples_ms, dtype=float)
+    if len(samples) == 0:
+        return {'n': 0}
+    return {
+        'n': len(samples),
+        'mean_ms': round(float(samples.mean()), 3),
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p95_ms': round(float(np.percentile(samples, 95)), 3),
+        'min_ms': round(float(samples.min()), 3),
+        'max_ms': round(float(samples.max()), 3),
+    }
+
+
+def timed_ms(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000, result
+
+
+# Local stand-ins ------------------------------------------------------------
+
+def haversine_m(a, b):
+    """Great-circle meters between (lng, lat) pairs"""
+    lng1, lat1, lng2, lat2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(h))
+
+
+def road_estimate(a, b):
+    """(seconds, meters) for a fake drive: 30% detour at 15 m/s"""
+    meters = haversine_m(a, b) * 1.3
+    return meters / 15.0, meters
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Base handler: waits the configured latency, then dispatches to respond()"""
+    latency_ms = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _send_json(self, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        time.sleep(self.latency_ms / 1000)
+        self.respond(None)
+
+    def do_POST(self):
+        body = self._body()
+        time.sleep(self.latency_ms / 1000)
+        self.respond(body)
+
+
+class MockORS(MockHandler):
+    """Directions (GeoJSON) and single-source matrix endpoints"""
+
+    def respond(self, body):
+        if '/matrix/' in self.path:
+            start, *dests = body['locations']
+            legs = [road_estimate(start, dest) for dest in dests]
+            self._send_json({'durations': [[s for s, _ in legs]], 'distances': [[m for _, m in legs]]})
+        else:
+            start, end = body['coordinates']
+            seconds, meters = road_estimate(start, end)
+            line = np.linspace(start, end, 20).tolist()
+            self._send_json({'type': 'FeatureCollection', 'features': [{
+                'type': 'Feature',
+                'geometry': {'type': 'LineString', 'coordinates': line},
+                'properties': {'segments': [{'duration': seconds, 'distance': meters}]},
+            }]})
+
+
+class MockNominatim(MockHandler):
+    """Places every query at a deterministic point derived from its text"""
+
+    def respond(self, body):
+        query = parse_qs(urlparse(self.path).query).get('q', [''])[0]
+        rng = random.Random(zlib.crc32(query.encode()))
+        lat = MOCK_CENTER[0] + rng.uniform(-MOCK_SPREAD_DEG, MOCK_SPREAD_DEG)
+        lng = MOCK_CENTER[1] + rng.uniform(-MOCK_SPREAD_DEG, MOCK_SPREAD_DEG)
+        self._send_json([{
+            'lat': str(lat), 'lon': str(lng), 'display_name': query, 'importance': 0.5,
+            'place_id': 1, 'osm_type': 'node', 'osm_id': 1, 'category': 'place', 'type': 'house',
+            'address': {'house_number': '1', 'road': query, 'country_code': 'us'},
+        }])
+
+
+class MockTGI(MockHandler):
+    """Text-generation-inference style endpoint; streams tokens as server-sent events"""
+    token_latency_ms = 0.0
+    tokens = 64
+
+    def respond(self, body):
+        params = body.get('parameters', {})
+        count = min(self.tokens, params.get('max_new_tokens') or self.tokens)
+        words = [f" word{i}" for i in range(count)]
+        if not body.get('stream'):
+            time.sleep(self.token_latency_ms * count / 1000)
+            self._send_json([{'generated_text': ''.join(words)}])
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        for i, word in enumerate(words):
+            time.sleep(self.token_latency_ms / 1000)
+            event = {'index': i, 'token': {'id': i, 'text': word, 'logprob': 0.0, 'special': False},
+                     'generated_text': ''.join(words) if i == count - 1 else None, 'details': None}
+            self.wfile.write(f"data:{json.dumps(event)}\n\n".encode())
+            self.wfile.flush()
+
+
+class MockOpenAI(MockHandler):
+    """OpenAI-compatible /v1/completions (list prompts answered in one request) and /v1/models"""
+    token_latency_ms = 0.0
+    tokens = 64
+
+    def respond(self, body):
+        if body is None:
+            self._send_json({'object': 'list', 'data': [{'id': 'local', 'object': 'model'}]})
+            return
+        prompts = body['prompt'] if isinstance(body['prompt'], list) else [body['prompt']]
+        count = min(self.tokens, body.get('max_tokens') or self.tokens)
+        words = [f" local{i}" for i in range(count)]
+        if not body.get('stream'):
+            time.sleep(self.token_latency_ms * count / 1000)
+            self._send_json({'choices': [{'index': i, 'text': ''.join(words)} for i in range(len(prompts))]})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        for word in words:
+            time.sleep(self.token_latency_ms / 1000)
+            self.wfile.write(f"data: {json.dumps({'choices': [{'index': 0, 'text': word}]})}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def start_server(handler, **attributes):
+    """Serve a handler subclass with the given class attributes on a free local port"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), type(handler.__name__, (handler,), attributes))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def configure_environment(args, cache_dir):
+    """Point every client at the stand-ins before the app modules are imported"""
+    servers = {
+        'ors': start_server(MockORS, latency_ms=args.ors_latency_ms),
+        'geocode': start_server(MockNominatim, latency_ms=args.geocode_latency_ms),
+        'llm': start_server(MockTGI, latency_ms=args.llm_latency_ms,
+                            token_latency_ms=args.token_latency_ms, tokens=args.llm_tokens),
+        'local_llm': start_server(MockOpenAI, latency_ms=args.local_llm_latency_ms,
+                                  token_latency_ms=args.token_latency_ms, tokens=args.llm_tokens),
+    }
+    os.environ.update({
+        'ORS_BASE_URL': servers['ors'][1],
+        'GEOCODE_URL': servers['geocode'][1] + '/search',
+        'HF_MODEL': servers['llm'][1],
+        'HF_API_TOKEN': 'bench',
+        'LOCAL_LLM_URL': servers['local_llm'][1] + '/v1',
+        # Fresh caches and no client-side throttling, so every request hits the stand-ins
+        'CACHE_DB_PATH': os.path.join(cache_dir, 'cache.sqlite3'),
+        'LLM_RESPONSE_CACHE': '0',
+        'ORS_REQUESTS_PER_MINUTE': '1000000',
+        'GEOCODE_REQUESTS_PER_MINUTE': '1000000',
+    })
+    return servers
+
+
+# Benchmarks -----------------------------------------------------------------
+
+def bench_dataset(args):
+    """Raw GeoJSON read, simplify_geojson, full cleaning, and the cached Parquet load"""
+    import geopandas as gpd
+    import water_data
+
+    read_ms, raw = timed_ms(gpd.read_file, water_data.SOURCE_PATH)
+    simplify_ms, _ = timed_ms(water_data.simplify_geojson, raw)
+    clean_ms, _ = timed_ms(water_data.clean_water_bodies, raw)
+    water_data.prepare_water_bodies()
+    load_samples = [timed_ms(water_data.load_water_bodies)[0] for _ in range(args.repeat)]
+    return {
+        'features': len(raw),
+        'read_geojson_ms': round(read_ms, 3),
+        'simplify_geojson_ms': round(simplify_ms, 3),
+        'clean_ms': round(clean_ms, 3),
+        'load_parquet': latency_stats(load_samples),
+    }
+
+
+def scaled_water_bodies(gdf, scale):
+    """scale copies of the layer tiled side by side, so density per area stays realistic"""
+    import geopandas as gpd
+    import pandas as pd
+
+    if scale == 1:
+        return gdf
+    min_lng, min_lat, max_lng, max_lat = gdf.total_bounds
+    width, height = max_lng - min_lng, max_lat - min_lat
+    side = math.ceil(math.sqrt(scale))
+    copies = [gdf.translate(xoff=(i % side) * width, yoff=(i // side) * height) for i in range(scale)]
+    return gpd.GeoDataFrame(
+        pd.concat([gdf] * scale, ignore_index=True).drop(columns='geometry'),
+        geometry=pd.concat(copies, ignore_index=True).values, crs=gdf.crs,
+    )
+
+
+def bench_nearest(args):
+    """Index build and k-nearest queries on the real layer and synthetic scaled-up copies"""
+    import shapely
+    import water_data
+    import water_index
+
+    base = water_data.load_water_bodies()
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for scale in args.scales:
+        gdf = scaled_water_bodies(base, scale)
+        build_ms, index = timed_ms(water_index.WaterBodyIndex, gdf)
+
+        # Query near random water bodies, jittered by a few km
+        rows = rng.integers(0, len(index), args.queries)
+        points = shapely.get_coordinates(shapely.centroid(index.gdf.geometry.values[rows]))
+        points += rng.normal(0, 0.03, points.shape)
+        samples = [timed_ms(index.nearest, lng, lat)[0] for lng, lat in points]
+        results.append({
+            'scale': scale,
+            'polygons': len(index),
+            'build_ms': round(build_ms, 3),
+            'query': latency_stats(samples),
+            'projections': index.projections.stats(),
+        })
+    return results
+
+
+def synthetic_history(turns, words_per_turn=60):
+    messages = [{'role': 'system', 'content': "You are a helpful fire response assistant. " * 20}]
+    for i in range(turns):
+        role = 'user' if i % 2 == 0 else 'assistant'
+        messages.append({'role': role, 'content': ' '.join(f"w{i}_{j}" for j in range(words_per_turn))})
+    return messages
+
+
+def bench_prompt(args):
+    """format_prompt versus the incremental, token-budgeted PromptContext on long histories"""
+    import api_handler
+
+    results = []
+    for turns in args.history_turns:
+        messages = synthetic_history(turns)
+        format_samples = [timed_ms(api_handler.format_prompt, messages)[0] for _ in range(args.repeat)]
+
+        # A conversation grows one turn at a time, so build the context the same way
+        context = api_handler.PromptContext()
+        for n in range(2, len(messages)):
+            context.build(messages[:n])
+        build_samples = [timed_ms(context.build, messages)[0] for _ in range(args.repeat)]
+        results.append({
+            'turns': turns,
+            'prompt_chars': len(api_handler.format_prompt(messages)),
+            'budgeted_chars': len(context.build(messages)),
+            'format_prompt': latency_stats(format_samples),
+            'prompt_context_build': latency_stats(build_samples),
+        })
+    return results
+
+
+def bench_end_to_end(args):
+    """Geocode -> nearest -> routing -> metrics -> LLM answer per unique address, plus streaming"""
+    import api_handler
+    import clients
+    import geocoding
+    import perf
+    import pipeline
+    import water_data
+    import water_index
+
+    index = water_index.WaterBodyIndex(water_data.load_water_bodies())
+    client = clients.get_ors_client()
+    perf.reset()
+
+    totals, first_tokens, failures = [], [], 0
+    for i in range(args.requests):
+        start = time.perf_counter()
+        g = geocoding.geocode_address(f"{100 + i} Bench Street, Chapel Hill, NC")
+        candidates = index.nearest(g.lng, g.lat)
+        centroids, routes, errors = pipeline.route_candidates(client, g.lng, g.lat, candidates)
+        metrics = pipeline.supply_metrics_for(candidates, centroids, routes, 3000, 15)
+        messages = [
+            {'role': 'system', 'content': f"Address: {g.address}. Sources: {len(metrics)}."},
+            {'role': 'user', 'content': "Which water source should we use?"},
+        ]
+        answer = api_handler.get_ai_response(messages)
+        totals.append((time.perf_counter() - start) * 1000)
+        failures += bool(errors) or answer.startswith("Error:")
+
+        stream_start = time.perf_counter()
+        stream = api_handler.stream_ai_response(messages, use_cache=False)
+        next(stream, None)
+        first_tokens.append((time.perf_counter() - stream_start) * 1000)
+        for _ in stream:
+            pass
+
+    return {
+        'requests': args.requests,
+        'failures': failures,
+        'request': latency_stats(totals),
+        'stream_first_token': latency_stats(first_tokens),
+        'spans': perf.summary(),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks with local API stand-ins")
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--output', default='bench_output.txt', help="JSON results file")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5, help="Repetitions for micro-benchmarks")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 4, 16],
+                        help="Dataset size multipliers for the nearest search")
+    parser.add_argument('--queries', type=int, default=200, help="Nearest queries per scale")
+    parser.add_argument('--history-turns', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--requests', type=int, default=20, help="End-to-end requests")
+    parser.add_argument('--ors-latency-ms', type=float, default=50)
+    parser.add_argument('--geocode-latency-ms', type=float, default=50)
+    parser.add_argument('--llm-latency-ms', type=float, default=200, help="Time to first token")
+    parser.add_argument('--local-llm-latency-ms', type=float, default=100,
+                        help="Time to first token of the local OpenAI-compatible fallback")
+    parser.add_argument('--token-latency-ms', type=float, default=5)
+    parser.add_argument('--llm-tokens', type=int, default=64)
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory(prefix='bench-cache-') as cache_dir:
+        configure_environment(args, cache_dir)
+        results = {
+            'timestamp': time.time(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'config': {key: value for key, value in vars(args).items() if key != 'output'},
+            'results': {},
+        }
+        for name in args.only:
+            print(f"Running {name}...", file=sys.stderr)
+            results['results'][name] = globals()[f"bench_{name}"](args)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
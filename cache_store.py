@@ -0,0 +1,126 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", os.path.join(".cache", "cache.sqlite3"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def _connect(path):
+    """One shared connection per database file, serialized by its own lock"""
+    with _connections_lock:
+        if path not in _connections:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (namespace, accessed)")
+            _connections[path] = (conn, threading.Lock())
+        return _connections[path]
+
+
+def normalize_address(address):
+    """Case, punctuation and whitespace-insensitive cache key for an address"""
+    return " ".join(address.lower().replace(",", " ").replace(".", " ").split())
+
+
+def coord_key(*parts, precision=5):
+    """Cache key from coordinate pairs rounded to ~1 m, plus any string parts like the profile"""
+    key = []
+    for part in parts:
+        if isinstance(part, str):
+            key.append(part)
+        else:
+            key.append(",".join(f"{float(c):.{precision}f}" for c in part))
+    return "|".join(key)
+
+
+class PersistentCache:
+    """SQLite-backed JSON cache with TTL expiry and least-recently-used eviction"""
+
+    def __init__(self, namespace, ttl, max_entries=CACHE_MAX_ENTRIES, path=CACHE_DB_PATH):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Cached value for key, or None if missing or expired"""
+        conn, lock = _connect(self.path)
+        now = time.time()
+        with lock:
+            row = conn.execute(
+                "SELECT value, created FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+                self.misses += 1
+                return None
+            conn.execute(
+                "UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key)
+            )
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """Store a JSON-serializable value, evicting expired then least recently used entries"""
+        conn, lock = _connect(self.path)
+        now = time.time()
+        with lock:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value), now, now)
+            )
+            expired = conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND created < ?", (self.namespace, now - self.ttl)
+            ).rowcount
+            (count,) = conn.execute("SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)).fetchone()
+            overflow = count - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                    " SELECT key FROM cache WHERE namespace = ? ORDER BY accessed LIMIT ?)",
+                    (self.namespace, self.namespace, overflow)
+                )
+            self.evictions += expired + max(overflow, 0)
+
+    def clear(self):
+        """Drop every entry in this namespace"""
+        conn, lock = _connect(self.path)
+        with lock:
+            conn.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+
+    def stats(self):
+        """Hit-rate statistics for this process, plus the current entry count"""
+        conn, lock = _connect(self.path)
+        with lock:
+            (entries,) = conn.execute(
+                "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'evictions': self.evictions,
+            'entries': entries,
+            'max_entries': self.max_entries,
+        }
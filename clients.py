@@ -0,0 +1,95 @@
+import os
+import threading
+
+import openrouteservice as ors
+from dotenv import load_dotenv
+from huggingface_hub import AsyncInferenceClient, InferenceClient
+from requests.adapters import HTTPAdapter
+
+load_dotenv()
+
+DEFAULT_ORS_KEY = '5b3ce3597851110001cf624850fbe0228cc9495a9cfa80d566733a79'
+DEFAULT_HF_MODEL = "mistralai/Mistral-7B-Instruct-v0.2"
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def config():
+    """Client settings read from the environment at call time"""
+    return {
+        'ors_key': os.getenv("ORS_API_KEY", DEFAULT_ORS_KEY),
+        'ors_base_url': os.getenv("ORS_BASE_URL", "https://api.openrouteservice.org"),
+        'ors_timeout': float(os.getenv("ORS_TIMEOUT", "30")),
+        'hf_token': os.getenv("HF_API_TOKEN"),
+        'hf_model': os.getenv("HF_MODEL", DEFAULT_HF_MODEL),
+        'hf_timeout': float(os.getenv("HF_TIMEOUT", "30")),
+        'pool_size': int(os.getenv("HTTP_POOL_SIZE", "10")),
+    }
+
+
+def _get_or_create(key, factory):
+    """Return the registered client for key, building it once under the lock"""
+    with _lock:
+        if key not in _clients:
+            _clients[key] = factory()
+        return _clients[key]
+
+
+def get_ors_client():
+    """Long-lived OpenRouteService client with a pooled keep-alive session"""
+    cfg = config()
+
+    def build():
+        client = ors.Client(key=cfg['ors_key'], base_url=cfg['ors_base_url'], timeout=cfg['ors_timeout'])
+        # Size the connection pool for concurrent routing threads
+        adapter = HTTPAdapter(pool_connections=cfg['pool_size'], pool_maxsize=cfg['pool_size'])
+        client._session.mount('https://', adapter)
+        client._session.mount('http://', adapter)
+        return client
+
+    return _get_or_create(('ors', cfg['ors_key'], cfg['ors_base_url'], cfg['ors_timeout'], cfg['pool_size']), build)
+
+
+def get_inference_client():
+    """Long-lived Hugging Face inference client, or None if no token is configured
+
+    Requests go through huggingface_hub's process-wide keep-alive session.
+    """
+    cfg = config()
+    if not cfg['hf_token']:
+        return None
+    return _get_or_create(
+        ('hf', cfg['hf_token'], cfg['hf_timeout']),
+        lambda: InferenceClient(token=cfg['hf_token'], timeout=cfg['hf_timeout'])
+    )
+
+
+def get_async_inference_client():
+    """Long-lived async inference client, or None if no token is configured
+
+    Its HTTP session binds to the event loop that first uses it, so only call
+    it from api_handler's background loop.
+    """
+    cfg = config()
+    if not cfg['hf_token']:
+        return None
+    return _get_or_create(
+        ('hf-async', cfg['hf_token'], cfg['hf_timeout']),
+        lambda: AsyncInferenceClient(token=cfg['hf_token'], timeout=cfg['hf_timeout'])
+    )
+
+
+def hf_model():
+    """Model used for chat responses"""
+    return config()['hf_model']
+
+
+def reset_clients():
+    """Drop every registered client so the next call rebuilds from the environment"""
+    with _lock:
+        for client in _clients.values():
+            session = getattr(client, '_session', None)
+            if session is not None:
+                session.close()
+        _clients.clear()
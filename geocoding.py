@@ -0,0 +1,46 @@
+import os
+from collections import namedtuple
+
+import geocoder
+
+import perf
+from cache_store import PersistentCache, normalize_address
+from routing import RateLimiter
+
+OSM_HEADERS = {
+    'User-Agent': 'FireResponseDashboard/1.0 (sashank.ganapathiraju@gmail.com)'
+}
+# Nominatim search endpoint (override for a self-hosted instance or a local stand-in)
+GEOCODE_URL = os.getenv("GEOCODE_URL", "https://nominatim.openstreetmap.org/search")
+# Addresses almost never move, so geocodes can live for a month
+GEOCODE_CACHE_TTL = float(os.getenv("GEOCODE_CACHE_TTL", str(30 * 24 * 3600)))
+
+GeocodeResult = namedtuple('GeocodeResult', ['ok', 'lat', 'lng', 'address'])
+
+# Nominatim's usage policy allows at most one request per second
+GEOCODE_REQUESTS_PER_MINUTE = int(os.getenv("GEOCODE_REQUESTS_PER_MINUTE", "60"))
+
+geocode_cache = PersistentCache('geocode', ttl=GEOCODE_CACHE_TTL)
+geocode_limiter = RateLimiter(GEOCODE_REQUESTS_PER_MINUTE, burst=1)
+perf.register_cache('geocode', geocode_cache.stats)
+
+
+def geocode_address(address):
+    """Geocode an address with OSM, serving repeat lookups from the persistent cache"""
+    with perf.span('geocode') as tags:
+        key = normalize_address(address)
+        cached = geocode_cache.get(key)
+        tags['cached'] = cached is not None
+        if cached is not None:
+            return GeocodeResult(*cached)
+
+        geocode_limiter.acquire()
+        g = geocoder.osm(address, headers=OSM_HEADERS, url=GEOCODE_URL)
+        tags['ok'] = g.ok
+        if not g.ok:
+            # Don't cache failures; they are often transient
+            return GeocodeResult(False, None, None, address)
+
+        result = GeocodeResult(True, g.lat, g.lng, g.address)
+        geocode_cache.set(key, list(result))
+        return result
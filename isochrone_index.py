@@ -0,0 +1,162 @@
+import os
+import sys
+
+import numpy as np
+import shapely
+from shapely import STRtree
+
+import water_data
+import water_index
+
+ISOCHRONE_DIR = os.path.join(water_data.CACHE_DIR, "isochrones")
+# Grid cell size in degrees (~1 km)
+DEFAULT_CELL_SIZE = float(os.getenv("ISOCHRONE_CELL_SIZE", "0.01"))
+# Sources kept per cell, ordered by drive time
+DEFAULT_SOURCES_PER_CELL = int(os.getenv("ISOCHRONE_SOURCES_PER_CELL", "5"))
+# Only sources within this straight-line distance of a cell are considered
+DEFAULT_SEARCH_RADIUS_M = float(os.getenv("ISOCHRONE_SEARCH_RADIUS_M", "15000"))
+# Cells processed per vectorized block during the build
+CELL_BLOCK = 4096
+
+# Road distance is longer than straight-line; Manhattan distance times a small
+# detour factor is a reasonable stand-in for a local street grid
+ROAD_DETOUR_FACTOR = 1.1
+AVERAGE_SPEED_KMH = 56.0
+
+
+def estimate_drive_minutes(origins, destinations):
+    """Local routing stand-in: pairwise drive minutes between (lng, lat) arrays of shape (P, 2)"""
+    mean_lat = np.radians((origins[:, 1] + destinations[:, 1]) / 2)
+    dx = np.abs(destinations[:, 0] - origins[:, 0]) * water_index.M_PER_DEG_LON * np.cos(mean_lat)
+    dy = np.abs(destinations[:, 1] - origins[:, 1]) * water_index.M_PER_DEG_LAT
+    road_meters = (dx + dy) * ROAD_DETOUR_FACTOR
+    return road_meters / (AVERAGE_SPEED_KMH * 1000 / 60)
+
+
+class IsochroneIndex:
+    """Regular lon/lat grid where each cell stores its best water sources by drive time
+
+    Only cells with sources are stored, CSR-style: cell_keys holds their
+    row-major cell numbers in ascending order and cell i's sources are
+    source_ids[offsets[i]:offsets[i + 1]], fastest first.
+    """
+
+    def __init__(self, origin, cell_size, shape, cell_keys, offsets, source_ids, minutes):
+        self.origin = origin          # (min_lng, min_lat) of cell (0, 0)
+        self.cell_size = cell_size
+        self.shape = shape            # (rows, cols) of the full grid
+        self.cell_keys = cell_keys    # (cells,) int64, sorted
+        self.offsets = offsets        # (cells + 1,) int64
+        self.source_ids = source_ids  # (entries,) int32
+        self.minutes = minutes        # (entries,) float32
+
+    @classmethod
+    def build(cls, index, cell_size=DEFAULT_CELL_SIZE, k=DEFAULT_SOURCES_PER_CELL,
+              search_radius=DEFAULT_SEARCH_RADIUS_M, drive_time_fn=estimate_drive_minutes):
+        """Precompute the grid over the layer's extent from a WaterBodyIndex
+
+        drive_time_fn takes (origins, destinations) arrays of (lng, lat) pairs
+        and returns drive minutes per pair, so a real local router can replace
+        the default estimate.
+        """
+        centroids = shapely.centroid(index.gdf.geometry.values)
+        centroid_xy = shapely.get_coordinates(centroids)
+
+        # Pad the extent so addresses just outside the layer still get a cell
+        pad_lat = search_radius / water_index.M_PER_DEG_LAT
+        min_lng, min_lat, max_lng, max_lat = index.gdf.total_bounds
+        far_lat = max(abs(min_lat), abs(max_lat))
+        pad_lng = search_radius / (water_index.M_PER_DEG_LON * np.cos(np.radians(far_lat)))
+        origin = (min_lng - pad_lng, min_lat - pad_lat)
+        cols = int(np.ceil((max_lng + pad_lng - origin[0]) / cell_size))
+        rows = int(np.ceil((max_lat + pad_lat - origin[1]) / cell_size))
+
+        # The degree radius uses the widest longitude span so nothing is missed
+        radius_deg = max(pad_lat, pad_lng)
+        tree = STRtree(centroids)
+        kept_cells, kept_ids, kept_minutes = [], [], []
+
+        # Work through the grid in blocks of row-major cell numbers so memory
+        # stays bounded on large extents; cell centers are made per block
+        for start in range(0, rows * cols, CELL_BLOCK):
+            cells = np.arange(start, min(start + CELL_BLOCK, rows * cols))
+            block_xy = np.column_stack([origin[0] + (cells % cols + 0.5) * cell_size,
+                                        origin[1] + (cells // cols + 0.5) * cell_size])
+
+            # Bulk radius query: every (cell, source) pair within the search radius
+            cell_idx, source_idx = tree.query(shapely.points(block_xy), predicate='dwithin', distance=radius_deg)
+            if len(cell_idx) == 0:
+                continue
+            minutes = drive_time_fn(block_xy[cell_idx], centroid_xy[source_idx])
+
+            # Keep the k fastest sources per cell: sort by (cell, minutes), then
+            # take each cell's first k entries
+            order = np.lexsort((minutes, cell_idx))
+            cell_idx, source_idx, minutes = cell_idx[order], source_idx[order], minutes[order]
+            rank = np.arange(len(cell_idx)) - np.searchsorted(cell_idx, cell_idx, side='left')
+            keep = rank < k
+
+            kept_cells.append(cells[cell_idx[keep]])
+            kept_ids.append(source_idx[keep].astype(np.int32))
+            kept_minutes.append(minutes[keep].astype(np.float32))
+
+        # Blocks are in cell order and each is sorted by cell, so the entries are too
+        entry_cells = np.concatenate(kept_cells) if kept_cells else np.array([], dtype=np.int64)
+        cell_keys, counts = np.unique(entry_cells, return_counts=True)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        source_ids = np.concatenate(kept_ids) if kept_ids else np.array([], dtype=np.int32)
+        minutes = np.concatenate(kept_minutes) if kept_minutes else np.array([], dtype=np.float32)
+        return cls(origin, cell_size, (rows, cols), cell_keys.astype(np.int64), offsets, source_ids, minutes)
+
+    def lookup(self, lng, lat):
+        """(source_ids, minutes) for the cell containing the point; empty outside the grid"""
+        rows, cols = self.shape
+        col = int((lng - self.origin[0]) // self.cell_size)
+        row = int((lat - self.origin[1]) // self.cell_size)
+        if 0 <= row < rows and 0 <= col < cols:
+            key = row * cols + col
+            pos = np.searchsorted(self.cell_keys, key)
+            if pos < len(self.cell_keys) and self.cell_keys[pos] == key:
+                entries = slice(self.offsets[pos], self.offsets[pos + 1])
+                return self.source_ids[entries], self.minutes[entries]
+        return np.array([], dtype=np.int32), np.array([], dtype=np.float32)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(tmp_path, origin=np.array(self.origin), cell_size=self.cell_size,
+                            shape=np.array(self.shape), cell_keys=self.cell_keys, offsets=self.offsets,
+                            source_ids=self.source_ids, minutes=self.minutes)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(tuple(data['origin']), float(data['cell_size']), tuple(int(n) for n in data['shape']),
+                   data['cell_keys'], data['offsets'], data['source_ids'], data['minutes'])
+
+
+def index_path(source_hash, cell_size=DEFAULT_CELL_SIZE, k=DEFAULT_SOURCES_PER_CELL,
+               search_radius=DEFAULT_SEARCH_RADIUS_M):
+    # "csr" marks the sparse layout, so grids saved in the old dense layout are rebuilt
+    return os.path.join(ISOCHRONE_DIR, f"{source_hash[:16]}_{cell_size:g}_{k}_{search_radius:g}_csr.npz")
+
+
+def load_or_build(index, source_hash, cell_size=DEFAULT_CELL_SIZE, k=DEFAULT_SOURCES_PER_CELL,
+                  search_radius=DEFAULT_SEARCH_RADIUS_M):
+    """Load the precomputed grid for this source version, building it on first use"""
+    path = index_path(source_hash, cell_size, k, search_radius)
+    if os.path.exists(path):
+        return IsochroneIndex.load(path)
+    isochrones = IsochroneIndex.build(index, cell_size, k, search_radius)
+    isochrones.save(path)
+    return isochrones
+
+
+if __name__ == "__main__":
+    # Usage: python isochrone_index.py [cell_size_degrees]
+    cell = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CELL_SIZE
+    source_hash = water_data.file_hash(water_data.SOURCE_PATH)
+    isochrones = IsochroneIndex.build(water_index.WaterBodyIndex(water_data.load_water_bodies()), cell)
+    isochrones.save(index_path(source_hash, cell))
+    print(index_path(source_hash, cell), f"{len(isochrones.cell_keys)} of {np.prod(isochrones.shape)} cells")
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import clients
+
+# Local OpenAI-compatible server (llama.cpp server, vLLM, Ollama, ...), e.g. http://127.0.0.1:8080/v1
+LOCAL_LLM_URL = os.getenv("LOCAL_LLM_URL", "")
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "local")
+LOCAL_LLM_TIMEOUT = float(os.getenv("LOCAL_LLM_TIMEOUT", "60"))
+# Quantized GGUF model run in-process through llama.cpp bindings (pip install llama-cpp-python)
+LLAMA_MODEL_PATH = os.getenv("LLAMA_MODEL_PATH", "")
+LLAMA_CONTEXT = int(os.getenv("LLAMA_CONTEXT", "4096"))
+LLAMA_THREADS = int(os.getenv("LLAMA_THREADS", str(os.cpu_count() or 4)))
+# Maximum simultaneous LLM requests per process, shared by every backend
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+
+# The prompt format uses these role tags, so local models should stop at the next turn
+STOP_SEQUENCES = ["<|user|>", "<|system|>"]
+
+_END = object()
+
+
+async def iterate_in_thread(executor, make_iterator):
+    """Consume a blocking token iterator on executor without blocking the event loop
+
+    Closing the async generator early (e.g. on cancellation) tells the worker
+    to stop pulling tokens.
+    """
+    loop = asyncio.get_running_loop()
+    tokens = asyncio.Queue()
+    stop = threading.Event()
+
+    def pump():
+        try:
+            for token in make_iterator():
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(tokens.put_nowait, token)
+        except Exception as e:
+            loop.call_soon_threadsafe(tokens.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(tokens.put_nowait, _END)
+
+    loop.run_in_executor(executor, pump)
+    try:
+        while True:
+            token = await tokens.get()
+            if token is _END:
+                return
+            if isinstance(token, Exception):
+                raise token
+            yield token
+    finally:
+        stop.set()
+
+
+class HFBackend:
+    """Hosted Hugging Face text generation (the original behaviour)"""
+    name = 'hf'
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix='llm-hf')
+
+    def available(self):
+        return bool(clients.config()['hf_token'])
+
+    def model_id(self):
+        return f"hf:{clients.hf_model()}"
+
+    def batch_requests(self, size):
+        """Requests a batch of size prompts has in flight at once"""
+        return min(size, LLM_MAX_CONCURRENCY)
+
+    def warm(self):
+        clients.get_inference_client()
+
+    def generate(self, prompt, params):
+        return clients.get_inference_client().text_generation(prompt=prompt, **params)
+
+    def generate_batch(self, prompts, params):
+        # The hosted API takes one prompt per request, so fan out on the pool
+        return list(self._executor.map(lambda prompt: self.generate(prompt, params), prompts))
+
+    async def stream(self, prompt, params):
+        client = clients.get_async_inference_client()
+        async for token in await client.text_generation(prompt=prompt, stream=True, **params):
+            yield token
+
+
+class OpenAICompatBackend:
+    """Local server speaking the OpenAI completions API; batches go out as one request"""
+    name = 'openai'
+
+    def __init__(self, base_url=LOCAL_LLM_URL, model=LOCAL_LLM_MODEL, timeout=LOCAL_LLM_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix='llm-openai')
+
+    def available(self):
+        return bool(self.base_url)
+
+    def model_id(self):
+        return f"openai:{self.base_url}:{self.model}"
+
+    def batch_requests(self, size):
+        return 1
+
+    def warm(self):
+        # Opens the keep-alive connection and fails fast if the server is down
+        self.session.get(f"{self.base_url}/models", timeout=self.timeout).raise_for_status()
+
+    def _payload(self, prompt, params, stream=False):
+        return {
+            'model': self.model,
+            'prompt': prompt,
+            'max_tokens': params['max_new_tokens'],
+            'temperature': params['temperature'],
+            'top_p': params['top_p'],
+            'seed': params['seed'],
+            'stop': STOP_SEQUENCES,
+            'stream': stream,
+        }
+
+    def generate_batch(self, prompts, params):
+        response = self.session.post(f"{self.base_url}/completions", json=self._payload(prompts, params),
+                                     timeout=self.timeout)
+        response.raise_for_status()
+        choices = sorted(response.json()['choices'], key=lambda choice: choice.get('index', 0))
+        return [choice['text'] for choice in choices]
+
+    def generate(self, prompt, params):
+        return self.generate_batch([prompt], params)[0]
+
+    def _stream_sync(self, prompt, params):
+        with self.session.post(f"{self.base_url}/completions", json=self._payload(prompt, params, stream=True),
+                               timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    return
+                text = json.loads(data)['choices'][0].get('text')
+                if text:
+                    yield text
+
+    async def stream(self, prompt, params):
+        async for token in iterate_in_thread(self._executor, lambda: self._stream_sync(prompt, params)):
+            yield token
+
+
+class LlamaCppBackend:
+    """Quantized GGUF model on the CPU via llama-cpp-python, loaded once per process
+
+    llama.cpp contexts aren't thread-safe, so every call runs on one worker
+    thread; batches are answered one prompt after another.
+    """
+    name = 'llama'
+
+    def __init__(self, model_path=LLAMA_MODEL_PATH, n_ctx=LLAMA_CONTEXT, n_threads=LLAMA_THREADS):
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads
+        self._model = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='llm-llama')
+
+    def available(self):
+        if not self.model_path or not os.path.exists(self.model_path):
+            return False
+        try:
+            import llama_cpp  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def model_id(self):
+        return f"llama:{self.model_path}"
+
+    def batch_requests(self, size):
+        return 1
+
+    def _load(self):
+        if self._model is None:
+            from llama_cpp import Llama
+
+            self._model = Llama(model_path=self.model_path, n_ctx=self.n_ctx, n_threads=self.n_threads,
+                                verbose=False)
+        return self._model
+
+    def warm(self):
+        self._executor.submit(self._load).result()
+
+    def _kwargs(self, params):
+        return {
+            'max_tokens': params['max_new_tokens'],
+            'temperature': params['temperature'],
+            'top_p': params['top_p'],
+            'repeat_penalty': params['repetition_penalty'],
+            'seed': params['seed'],
+            'stop': STOP_SEQUENCES,
+        }
+
+    def _generate_sync(self, prompt, params):
+        return self._load()(prompt, **self._kwargs(params))['choices'][0]['text']
+
+    def generate(self, prompt, params):
+        return self._executor.submit(self._generate_sync, prompt, params).result()
+
+    def generate_batch(self, prompts, params):
+        return self._executor.submit(lambda: [self._generate_sync(p, params) for p in prompts]).result()
+
+    def _stream_sync(self, prompt, params):
+        for chunk in self._load()(prompt, stream=True, **self._kwargs(params)):
+            yield chunk['choices'][0]['text']
+
+    async def stream(self, prompt, params):
+        async for token in iterate_in_thread(self._executor, lambda: self._stream_sync(prompt, params)):
+            yield token
+
+
+BACKENDS = {backend.name: backend for backend in (HFBackend, OpenAICompatBackend, LlamaCppBackend)}
@@ -3,54 +3,53 @@ from streamlit_stl import stl_from_file
 import api_handler
 import os
 from dotenv import load_dotenv
-import time
+import uuid
 import numpy as np
+import pandas as pd
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
 import folium
 from streamlit_folium import st_folium
-import geopandas as gpd
-import geocoder
-from shapely.geometry import Point
 from shapely.ops import nearest_points
-import openrouteservice as ors
 from datetime import datetime
 import requests
+import accel_analytics
+import accel_stream
+import clients
+import geocoding
+import isochrone_index
+import map_tiles
+import mesh_prep
+import perf
+import pipeline
+import sessions
+import water_data
+import water_index
+
+MAP_WIDTH = 1400
+MAP_HEIGHT = 600
+# Latency/cache panel at the bottom of the page (also shown with ?debug=1)
+PERF_DEBUG_PANEL = os.getenv("PERF_DEBUG_PANEL", "").lower() in ("1", "true", "yes")
+BUILDING_MODEL = os.getenv("BUILDING_MODEL", "Cottage_FREE.stl")
+# Trucks a water source can fill at the same time (hydrant ports, drafting sites)
+FILL_SITE_SLOTS = int(os.getenv("FILL_SITE_SLOTS", "1"))
+# Live accelerometer chart: redraw interval and points drawn per axis
+ACCEL_REFRESH_SECONDS = float(os.getenv("ACCEL_REFRESH_SECONDS", "1"))
+ACCEL_DISPLAY_POINTS = int(os.getenv("ACCEL_DISPLAY_POINTS", "2000"))
+ACCEL_DOWNSAMPLE = os.getenv("ACCEL_DOWNSAMPLE", "minmax")  # minmax or lttb
 
 
 def check_api_token():
-    """Verify API token is set"""
-    if not os.getenv("HF_API_TOKEN"):
-        st.error("⚠️ HF_API_TOKEN not found. Please check your .env file.")
+    """Verify at least one chat backend is configured (hosted token, local server or local model)"""
+    if not api_handler.get_backends():
+        st.error(f"⚠️ {api_handler.NO_BACKEND_MESSAGE}. Please check your .env file.")
         st.stop()
 
-def get_route_details(client, start_coords, end_coords):
-    """Get route details using OpenRouteService"""
-    try:
-        routes = client.directions(
-            coordinates=[start_coords, end_coords],
-            profile='driving-car',
-            format='geojson'
-        )
-        
-        # Extract duration (seconds) and distance (meters)
-        duration = routes['features'][0]['properties']['segments'][0]['duration']
-        distance = routes['features'][0]['properties']['segments'][0]['distance']
-        
-        # Convert to minutes and miles
-        duration_minutes = duration / 60
-        distance_miles = distance * 0.000621371
-        
-        # Get the route geometry
-        route_coords = routes['features'][0]['geometry']['coordinates']
-        # Flip coordinates for folium (lat, lng)
-        route_coords = [[coord[1], coord[0]] for coord in route_coords]
-
-        return duration_minutes, distance_miles, route_coords
-    
-    except Exception as e:
-        st.warning(f"Could not get route details: {str(e)}")
-        return None, None, None
+@st.cache_resource(show_spinner=False)
+def warm_llm_backends():
+    """Load local models and open backend connections once per process, in the background"""
+    api_handler.warm_backends()
+    return True
 
 def calculate_water_metrics(duration_minutes, distance_miles, tank_capacity, flow_rate, route_coords, centroid, row):
     """Calculate water supply metrics for a single water body"""
@@ -70,43 +69,25 @@ def calculate_water_metrics(duration_minutes, distance_miles, tank_capacity, flo
         'row': row
     }
 
-def add_markers_and_routes(m, g, supply_metrics, gdf):
-    """Add all markers and routes to the map"""
-    # Add home marker
-    folium.Marker(
-        location=[g.lat, g.lng],
-        popup=folium.Popup(f"Address: {g.address}<br>Coordinates: {g.lat:.6f}, {g.lng:.6f}", max_width=300),
-        icon=folium.Icon(color='red', icon='home')
-    ).add_to(m)
+def add_water_layer(m, water_layer):
+    """Add viewport-clipped water bodies (a GeoJSON FeatureCollection) as a layer"""
+    if not water_layer['features']:
+        return m
     
-    if supply_metrics:
-        # Calculate color scale
-        max_score = max(m['efficiency_score'] for m in supply_metrics)
-        min_score = min(m['efficiency_score'] for m in supply_metrics)
-        score_range = max_score - min_score
-        
-        # Add routes and markers
-        for metric in supply_metrics:
-            normalized_score = (metric['efficiency_score'] - min_score) / score_range
-            color = f'#{int(normalized_score * 255):02x}{int((1-normalized_score) * 255):02x}00'
-            
-            add_route_and_marker(m, metric, color)
-    
-    # Add base water bodies layer
     folium.GeoJson(
-        data=gdf,
-        name='All Water Bodies',
+        data=water_layer,
+        name='Water Bodies',
         style_function=lambda x: {
             'fillColor': '#0066cc',
             'color': '#004d99',
             'weight': 1,
             'fillOpacity': 0.6
-        }
+        },
+        tooltip=folium.GeoJsonTooltip(fields=['NAME', 'FTYPE'], aliases=['Name', 'Type'])
     ).add_to(m)
-    
     return m
 
-def update_chat_context(address, tank_capacity, fill_time, supply_metrics=None):
+def update_chat_context(address, tank_capacity, fill_time, supply_metrics=None, shuttle_plan=None):
     context = (
         "You are a helpful fire response assistant with access to the following information:\n"
         f"- Current Address: {address}\n"
@@ -124,21 +105,378 @@ def update_chat_context(address, tank_capacity, fill_time, supply_metrics=None):
                 f"   - Max Sustainable Flow Rate: {metric['max_flow_rate']:.0f} GPM\n"
             )
     
-    # Update the system message
-    st.session_state.messages = [
-        {"role": "system", "content": context}
+    if shuttle_plan:
+        context += f"\nRecommended Shuttle ({shuttle_plan['trucks_used']} trucks, {shuttle_plan['total_flow']:.0f} GPM total):\n"
+        for source in shuttle_plan['sources']:
+            context += (
+                f"- {source['metric']['row']['NAME']}: {source['trucks']} trucks, "
+                f"{source['flow_rate']:.0f} GPM\n"
+            )
+    
+    if accel_stream.ACCEL_SOURCE:
+        events = get_accel_monitor().recent()
+        if events:
+            context += "\nRecent Accelerometer Events:\n"
+            context += "".join(f"- {line}\n" for line in accel_analytics.format_events(events))
+    
+    # Remembered so the context can be refreshed when new sensor events arrive
+    st.session_state.chat_context_args = (address, tank_capacity, fill_time, supply_metrics, shuttle_plan)
+    
+    # Update the system message, keeping the conversation so far
+    st.session_state.messages = [{"role": "system", "content": context}] + [
+        msg for msg in st.session_state.get("messages", []) if msg["role"] != "system"
     ]
 
-def simplify_geojson(gdf, tolerance=0.001):
-    """Simplify geometries and remove unnecessary columns"""
-    # Keep only essential columns
-    essential_columns = ['NAME', 'FTYPE', 'FCODE_DESC', 'geometry']
-    gdf = gdf[essential_columns].copy()
+def get_water_bodies(source_hash, tolerance=water_data.DEFAULT_TOLERANCE):
+    """The water body layer, shared by every session (the index holds the only copy)"""
+    return get_water_index(source_hash, tolerance).gdf
+
+@st.cache_resource(show_spinner=False)
+def get_water_index(source_hash, tolerance=water_data.DEFAULT_TOLERANCE):
+    """Load the layer and build the spatial index once per process, shared across sessions"""
+    return water_index.WaterBodyIndex(water_data.load_water_bodies(water_data.SOURCE_PATH, tolerance))
+
+@st.cache_resource(show_spinner=False)
+def get_isochrone_index(source_hash, tolerance=water_data.DEFAULT_TOLERANCE):
+    """Precomputed drive-time grid, loaded from disk or built on first use"""
+    return isochrone_index.load_or_build(get_water_index(source_hash, tolerance), source_hash)
+
+@st.cache_resource(show_spinner=False)
+def get_tile_store(source_hash, tolerance=water_data.DEFAULT_TOLERANCE):
+    """Viewport tile store for the base water layer, shared across sessions"""
+    return map_tiles.WaterTileStore(get_water_index(source_hash, tolerance), source_hash)
+
+@st.cache_data(show_spinner=False)
+def accelerometer_figure():
+    """Demo accelerometer chart, also used as the layout for the live chart; built only once"""
+    # Generate static time series data
+    time_range = np.linspace(0, 10, 1000)  # 10 seconds of data with 1000 points
     
-    # Simplify geometries
-    gdf['geometry'] = gdf['geometry'].simplify(tolerance=tolerance, preserve_topology=True)
+    # Create interesting patterns for each axis
+    x_data = 0.5 * np.sin(2 * np.pi * 0.5 * time_range) + 0.2 * np.sin(2 * np.pi * 2 * time_range)
+    y_data = 0.3 * np.cos(2 * np.pi * 0.7 * time_range) + 0.1 * np.cos(2 * np.pi * 3 * time_range)
+    z_data = 0.4 * np.sin(2 * np.pi * 0.3 * time_range) * np.exp(-0.1 * time_range)
+    
+    # Create the graph
+    fig = go.Figure()
     
-    return gdf
+    # Add traces for each axis
+    fig.add_trace(go.Scatter(
+        x=time_range, 
+        y=x_data,
+        name='X-axis',
+        line=dict(color='red', width=2)
+    ))
+    fig.add_trace(go.Scatter(
+        x=time_range, 
+        y=y_data,
+        name='Y-axis',
+        line=dict(color='green', width=2)
+    ))
+    fig.add_trace(go.Scatter(
+        x=time_range, 
+        y=z_data,
+        name='Z-axis',
+        line=dict(color='blue', width=2)
+    ))
+
+    # Update layout with more detailed styling
+    fig.update_layout(
+        title={
+            'text': 'Accelerometer Data Analysis',
+            'y':0.95,
+            'x':0.5,
+            'xanchor': 'center',
+            'yanchor': 'top'
+        },
+        xaxis_title='Time (seconds)',
+        yaxis_title='Acceleration (g)',
+        height=400,
+        margin=dict(l=60, r=30, t=50, b=50),
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        ),
+        plot_bgcolor='white',
+        xaxis=dict(
+            showgrid=True,
+            gridwidth=1,
+            gridcolor='lightgray',
+            zeroline=True,
+            zerolinewidth=1,
+            zerolinecolor='lightgray'
+        ),
+        yaxis=dict(
+            showgrid=True,
+            gridwidth=1,
+            gridcolor='lightgray',
+            zeroline=True,
+            zerolinewidth=1,
+            zerolinecolor='lightgray'
+        )
+    )
+    
+    return fig
+
+@st.cache_data(show_spinner=False)
+def source_file_hash(path, mtime, size):
+    """Content hash of the water source file; mtime and size key the memo so it's only rehashed on change"""
+    return water_data.file_hash(path)
+
+@st.cache_data(show_spinner=False)
+def building_mesh_lods(path, mtime):
+    """Decimated levels of the building model, {triangle budget: STL path}; mtime keys the memo"""
+    return mesh_prep.prepare_mesh(path)
+
+@st.cache_resource(show_spinner=False)
+def get_accel_hub():
+    """Process-wide ring buffers, fed by one background reader when ACCEL_SOURCE is set"""
+    hub = accel_stream.AccelerometerHub()
+    if accel_stream.ACCEL_SOURCE:
+        accel_stream.start_ingest(hub)
+    return hub
+
+@st.cache_resource(show_spinner=False)
+def get_accel_monitor():
+    """Shared analytics over the hub's buffers, so each window is analyzed once for all sessions"""
+    return accel_analytics.AccelMonitor(get_accel_hub())
+
+def downsample(times, values):
+    if ACCEL_DOWNSAMPLE == 'lttb':
+        return accel_stream.lttb(times, values, ACCEL_DISPLAY_POINTS)
+    return accel_stream.minmax_downsample(times, values, ACCEL_DISPLAY_POINTS // 2)
+
+@st.fragment(run_every=ACCEL_REFRESH_SECONDS if accel_stream.ACCEL_SOURCE else None)
+def render_accelerometer():
+    """Live accelerometer chart; reruns on its own timer without touching the rest of the page"""
+    if not accel_stream.ACCEL_SOURCE:
+        # No stream configured: show the demo signal
+        st.plotly_chart(accelerometer_figure(), use_container_width=True)
+        return
+
+    hub = get_accel_hub()
+    devices = hub.devices()
+    if not devices:
+        st.info(f"Waiting for accelerometer data on {accel_stream.ACCEL_SOURCE}...")
+        return
+    device = st.selectbox("Device", devices, key='accel_device') if len(devices) > 1 else devices[0]
+
+    # The figure lives in session state; each tick only swaps the trace data
+    if 'accel_fig' not in st.session_state:
+        st.session_state.accel_fig = go.Figure(accelerometer_figure())
+        st.session_state.accel_fig.update_layout(xaxis_title='Time (seconds, latest = 0)')
+    fig = st.session_state.accel_fig
+
+    times, values = hub.buffer(device).snapshot()
+    times = times - times[-1] if len(times) else times
+    with fig.batch_update():
+        for axis, trace in enumerate(fig.data):
+            trace.x, trace.y = downsample(times, values[:, axis])
+    st.plotly_chart(fig, use_container_width=True)
+
+    # Analytics over the windows that arrived since the last tick
+    monitor = get_accel_monitor()
+    monitor.update()
+    latest = monitor.latest.get(device)
+    if latest is not None:
+        st.caption(
+            f"RMS {latest['rms_magnitude']:.2f} g · peak {latest['peak_g']:.2f} g · "
+            f"dominant {latest['dominant_hz']:.1f} Hz · {latest['peak_count']} peaks in last window"
+        )
+    events = monitor.recent()
+    for line in accel_analytics.format_events(events[-3:]):
+        st.warning(line, icon='💥')
+
+    # New events go into the assistant's context once an address has been planned
+    if events and events[-1] != st.session_state.get('accel_last_event'):
+        st.session_state.accel_last_event = events[-1]
+        if 'chat_context_args' in st.session_state:
+            update_chat_context(*st.session_state.chat_context_args)
+
+# Pipeline stages: address -> geocode -> candidates -> routes -> metrics -> map.
+# Each stage takes only the inputs it declares and is memoized on them, so
+# changing truck capacity or fill time reruns just the metrics and map stages.
+
+@st.cache_data(show_spinner=False, max_entries=512)
+def geocode_stage(address):
+    """Geocode an address; raises LookupError on failure so failures aren't memoized"""
+    g = geocoding.geocode_address(address)
+    if not g.ok:
+        raise LookupError(f"Could not geocode {address}")
+    return g
+
+@st.cache_data(show_spinner=False, max_entries=512)
+def candidates_stage(source_hash, lng, lat):
+    """Candidate water bodies for a geocoded point"""
+    return pipeline.find_candidates(
+        get_water_bodies(source_hash), get_water_index(source_hash), get_isochrone_index(source_hash), lng, lat
+    )
+
+def routes_stage(lng, lat, candidates):
+    """Routes to each candidate; memoized in routing's persistent cache, which skips failures"""
+    return pipeline.route_candidates(clients.get_ors_client(), lng, lat, candidates)
+
+def metrics_stage(candidates, centroids, routes, tank_capacity, fill_time):
+    """Flow metrics from cached routes; cheap enough to recompute on every input change"""
+    return pipeline.supply_metrics_for(candidates, centroids, routes, tank_capacity, fill_time)
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def water_layer_stage(source_hash, lng, lat, zoom_level):
+    """Viewport-clipped water body GeoJSON around the map center"""
+    return get_tile_store(source_hash).viewport_geojson(lng, lat, zoom_level, MAP_WIDTH, MAP_HEIGHT)
+
+def map_stage(map_center, zoom_level, g, address, supply_metrics, water_layer):
+    """Folium map with the address, water layer, and color-ranked sources and routes"""
+    m = folium.Map(location=map_center, zoom_start=zoom_level)
+    
+    # Add marker for the input address
+    if g.ok:
+        folium.Marker(
+            location=[g.lat, g.lng],
+            popup=folium.Popup(
+                f"Address: {address}<br>"
+                f"Coordinates: {g.lat:.6f}, {g.lng:.6f}",
+                max_width=300
+            ),
+            icon=folium.Icon(color='red', icon='home')
+        ).add_to(m)
+    
+    # Base water layer, limited to what the map actually shows
+    add_water_layer(m, water_layer)
+    
+    # Add markers and routes (metrics are sorted by max flow rate, best first)
+    for idx, metric in enumerate(supply_metrics):
+        normalized_score = idx / (len(supply_metrics) - 1) if len(supply_metrics) > 1 else 0
+        if normalized_score < 0.5:
+            # Green to Yellow (reversed from before - now green is best)
+            green = 255
+            red = int(normalized_score * 2 * 255)
+            color = f'#{red:02x}{green:02x}00'
+            marker_color = 'green'  # For the pin
+        else:
+            # Yellow to Red
+            red = 255
+            green = int((1 - normalized_score) * 2 * 255)
+            color = f'#{red:02x}{green:02x}00'
+            marker_color = 'red'  # For the pin
+        
+        # Add route with increased thickness (only the top candidates carry a route line)
+        if metric['route_coords']:
+            folium.PolyLine(
+                locations=metric['route_coords'],
+                weight=6,
+                color=color,
+                opacity=0.8
+            ).add_to(m)
+        
+        # Add marker with matching color
+        folium.Marker(
+            location=[metric['centroid'].y, metric['centroid'].x],
+            popup=folium.Popup(
+                f"Name: {metric['row']['NAME']}<br>"
+                f"Type: {metric['row']['FTYPE']}<br>"
+                f"Drive Distance: {metric['distance']:.1f} miles<br>"
+                f"Round Trip Time: {metric['round_trip']:.0f} min<br>"
+                f"Max Flow Rate: {metric['max_flow_rate']:.0f} GPM",
+                max_width=300
+            ),
+            icon=folium.Icon(color=marker_color, icon='tint', prefix='fa')
+        ).add_to(m)
+    
+    return m
+
+@st.fragment
+def render_chat():
+    """Chat pane; runs as a fragment so sending a message doesn't rerun the map and routing"""
+    # Create the input at the top
+    user_input = st.chat_input("What would you like to know about fire response?")
+
+    # Create a container with fixed height for scrolling
+    chat_container = st.container(height=500)
+
+    # Display messages in reverse order (newest first)
+    with chat_container:
+        for message in reversed(st.session_state.messages[1:]):  # Skip system message
+            with st.chat_message(message["role"]):
+                st.write(message["content"])
+        
+        # Older messages were moved to disk; read them back only when asked, a page at a time
+        if st.session_state.spilled_messages and st.toggle(
+                f"Show earlier messages ({st.session_state.spilled_messages})", key="show_spilled"):
+            shown = st.session_state.get("spilled_shown", sessions.CHAT_SPILL_PAGE)
+            for message in reversed(sessions.spilled_messages(st.session_state.chat_session_id, limit=shown)):
+                st.markdown(f"**{message['role']}:** {message['content']}")
+            if shown < st.session_state.spilled_messages:
+                st.button("Load older messages", on_click=lambda: st.session_state.update(
+                    spilled_shown=shown + sessions.CHAT_SPILL_PAGE))
+
+    # Handle new input
+    if user_input:
+        try:
+            # Add user message to state so it is part of the prompt
+            st.session_state.messages.append({"role": "user", "content": user_input})
+            response_stream = api_handler.stream_ai_response(
+                st.session_state.messages,
+                session_id=st.session_state.chat_session_id,
+                prompt_context=st.session_state.prompt_context
+            )
+            first_chunk = next(response_stream, "")
+
+            if first_chunk.startswith("Error:"):
+                st.session_state.messages.pop()
+                st.toast(first_chunk, icon='❌')
+            else:
+                # Create a message placeholder for the assistant's response
+                with chat_container:
+                    with st.chat_message("assistant"):
+                        message_placeholder = st.empty()
+                        full_response = first_chunk
+
+                        # Render tokens as they arrive from the model
+                        for chunk in response_stream:
+                            if chunk.startswith("Error:"):
+                                st.toast(chunk, icon='❌')
+                                break
+                            full_response += chunk
+                            # Add a blinking cursor to make it look more interactive
+                            message_placeholder.markdown(full_response + "▌")
+
+                        # Remove the cursor and set the final response
+                        message_placeholder.markdown(full_response)
+
+                        # Add the complete response to session state
+                        st.session_state.messages.append(
+                            {"role": "assistant", "content": full_response}
+                        )
+                        # Keep per-session memory bounded on long incidents
+                        st.session_state.spilled_messages += sessions.trim_history(
+                            st.session_state.chat_session_id, st.session_state.messages
+                        )
+
+        except Exception as e:
+            st.toast(f"Chat error: {str(e)}", icon='❌')
+
+def render_debug_panel(session_bytes):
+    """Per-stage latency, cache hit rates and per-session memory for this server process"""
+    with st.expander("Performance", expanded=False):
+        spans = perf.summary()
+        if spans:
+            st.dataframe(pd.DataFrame.from_dict(spans, orient='index'), use_container_width=True)
+        st.dataframe(pd.DataFrame.from_dict(perf.cache_stats(), orient='index'), use_container_width=True)
+        st.json(perf.recent(20), expanded=False)
+        
+        health = api_handler.backend_health.stats()
+        if health:
+            st.caption("LLM backends")
+            st.dataframe(pd.DataFrame.from_dict(health, orient='index'), use_container_width=True)
+        
+        st.caption("Session memory (bytes)")
+        st.dataframe(pd.DataFrame.from_dict(sessions.session_usage(), orient='index'), use_container_width=True)
+        st.dataframe(pd.Series(session_bytes, name='this session').sort_values(ascending=False),
+                     use_container_width=True)
 
 def main():
     # Set page config to wide mode
@@ -174,10 +512,17 @@ def main():
     # Load environment variables and check API token
     load_dotenv()
     check_api_token()
+    warm_llm_backends()
     
     # Initialize session states
     if "api_error" not in st.session_state:
         st.session_state.api_error = None
+    if "chat_session_id" not in st.session_state:
+        st.session_state.chat_session_id = uuid.uuid4().hex
+    if "prompt_context" not in st.session_state:
+        st.session_state.prompt_context = api_handler.PromptContext()
+    if "spilled_messages" not in st.session_state:
+        st.session_state.spilled_messages = 0
     if "messages" not in st.session_state:
         st.session_state.messages = [
             {"role": "system", "content": "You are a helpful fire response assistant."}
@@ -190,8 +535,14 @@ def main():
     
     # Left column: STL Model
     with col1:
+        lods = building_mesh_lods(BUILDING_MODEL, os.path.getmtime(BUILDING_MODEL))
+        # Coarsest level first for a fast first paint; more detail on request
+        detail = min(lods)
+        if len(lods) > 1:
+            detail = st.select_slider("Model detail", options=list(lods), value=detail,
+                                      format_func=lambda n: f"up to {n:,} triangles")
         stl_from_file(
-            file_path='Cottage_FREE.stl', 
+            file_path=lods[detail], 
             color='#FF9900',
             material='material',
             auto_rotate=False,
@@ -207,53 +558,7 @@ def main():
     
     # Middle column: Chat Interface with scrolling
     with col2:
-        # Create the input at the top
-        user_input = st.chat_input("What would you like to know about fire response?")
-
-        # Create a container with fixed height for scrolling
-        chat_container = st.container(height=500)
-        
-        # Display messages in reverse order (newest first)
-        with chat_container:
-            for message in reversed(st.session_state.messages[1:]):  # Skip system message
-                with st.chat_message(message["role"]):
-                    st.write(message["content"])
-
-        # Handle new input
-        if user_input:
-            try:
-                response_stream = api_handler.get_ai_response(st.session_state.messages)
-                
-                if isinstance(response_stream, str) and response_stream.startswith("Error:"):
-                    st.toast(response_stream, icon='❌')
-                    time.sleep(3)
-                else:
-                    # Add user message to state
-                    st.session_state.messages.append({"role": "user", "content": user_input})
-                    
-                    # Create a message placeholder for the assistant's response
-                    with chat_container:
-                        with st.chat_message("assistant"):
-                            message_placeholder = st.empty()
-                            full_response = ""
-                            
-                            # Process the stream
-                            for chunk in response_stream:
-                                full_response += chunk
-                                # Add a blinking cursor to make it look more interactive
-                                message_placeholder.markdown(full_response + "▌")
-                            
-                            # Remove the cursor and set the final response
-                            message_placeholder.markdown(full_response)
-                            
-                            # Add the complete response to session state
-                            st.session_state.messages.append(
-                                {"role": "assistant", "content": full_response}
-                            )
-                            
-            except Exception as e:
-                st.toast(f"Chat error: {str(e)}", icon='❌')
-                time.sleep(3)
+        render_chat()
     
     # Right column: Image
     with col3:
@@ -265,85 +570,13 @@ def main():
 
     # Accelerometer Graph Section (below all columns)
     st.subheader("Accelerometer Data")
-    
-    # Generate static time series data
-    time_range = np.linspace(0, 10, 1000)  # 10 seconds of data with 1000 points
-    
-    # Create interesting patterns for each axis
-    x_data = 0.5 * np.sin(2 * np.pi * 0.5 * time_range) + 0.2 * np.sin(2 * np.pi * 2 * time_range)
-    y_data = 0.3 * np.cos(2 * np.pi * 0.7 * time_range) + 0.1 * np.cos(2 * np.pi * 3 * time_range)
-    z_data = 0.4 * np.sin(2 * np.pi * 0.3 * time_range) * np.exp(-0.1 * time_range)
-    
-    # Create the graph
-    fig = go.Figure()
-    
-    # Add traces for each axis
-    fig.add_trace(go.Scatter(
-        x=time_range, 
-        y=x_data,
-        name='X-axis',
-        line=dict(color='red', width=2)
-    ))
-    fig.add_trace(go.Scatter(
-        x=time_range, 
-        y=y_data,
-        name='Y-axis',
-        line=dict(color='green', width=2)
-    ))
-    fig.add_trace(go.Scatter(
-        x=time_range, 
-        y=z_data,
-        name='Z-axis',
-        line=dict(color='blue', width=2)
-    ))
-
-    # Update layout with more detailed styling
-    fig.update_layout(
-        title={
-            'text': 'Accelerometer Data Analysis',
-            'y':0.95,
-            'x':0.5,
-            'xanchor': 'center',
-            'yanchor': 'top'
-        },
-        xaxis_title='Time (seconds)',
-        yaxis_title='Acceleration (g)',
-        height=400,
-        margin=dict(l=60, r=30, t=50, b=50),
-        legend=dict(
-            orientation="h",
-            yanchor="bottom",
-            y=1.02,
-            xanchor="right",
-            x=1
-        ),
-        plot_bgcolor='white',
-        xaxis=dict(
-            showgrid=True,
-            gridwidth=1,
-            gridcolor='lightgray',
-            zeroline=True,
-            zerolinewidth=1,
-            zerolinecolor='lightgray'
-        ),
-        yaxis=dict(
-            showgrid=True,
-            gridwidth=1,
-            gridcolor='lightgray',
-            zeroline=True,
-            zerolinewidth=1,
-            zerolinecolor='lightgray'
-        )
-    )
-
-    # Display the graph
-    st.plotly_chart(fig, use_container_width=True)
+    render_accelerometer()
     
     # Add Map Section
     st.subheader("Water Bodies")
     
-    # Create three columns for inputs
-    col1, col2, col3 = st.columns(3)
+    # Create columns for inputs
+    col1, col2, col_trucks, col3 = st.columns(4)
     with col1:
         tank_capacity = st.number_input("Fire Truck Water Capacity (gallons):", 
                                       value=3000, 
@@ -354,6 +587,12 @@ def main():
                                    value=15, 
                                    min_value=1,
                                    help="Time needed to fill the truck at the water source")
+    with col_trucks:
+        trucks = st.number_input("Number of Trucks:",
+                                 value=1,
+                                 min_value=1,
+                                 max_value=100,
+                                 help="Identical trucks available to shuttle water")
     with col3:
         st.markdown("### Maximum Flow Rate")
         st.markdown("*Calculated based on distance and fill time*")
@@ -364,92 +603,52 @@ def main():
     try:
         # Show loading toast
         toast_placeholder = st.toast('Loading map and calculating routes...', icon='🔄')
-        time.sleep(0.1)  # Small delay to ensure toast appears
         
-        # Initialize OpenRouteService client
-        ors_client = ors.Client(key='5b3ce3597851110001cf624850fbe0228cc9495a9cfa80d566733a79')
+        source_stat = os.stat(water_data.SOURCE_PATH)
+        source_hash = source_file_hash(water_data.SOURCE_PATH, source_stat.st_mtime, source_stat.st_size)
         
-        # Geocode the address with custom user agent
-        g = geocoder.osm(address, headers={
-            'User-Agent': 'FireResponseDashboard/1.0 (sashank.ganapathiraju@gmail.com)'
-        })
-        
-        if g.ok:
+        try:
+            g = geocode_stage(address)
             map_center = [g.lat, g.lng]
             zoom_level = 16
-        else:
+        except LookupError:
+            g = geocoding.GeocodeResult(False, None, None, address)
             st.toast('Could not find address. Showing default location.', icon='⚠️')
             map_center = [35.9132, -79.0558]
             zoom_level = 12
-            time.sleep(3)  # Keep warning visible for 3 seconds
-        
-        m = folium.Map(location=map_center, zoom_start=zoom_level)
         
-        # Add marker for the input address
+        supply_metrics = []
         if g.ok:
-            folium.Marker(
-                location=[g.lat, g.lng],
-                popup=folium.Popup(
-                    f"Address: {address}<br>"
-                    f"Coordinates: {g.lat:.6f}, {g.lng:.6f}",
-                    max_width=300
-                ),
-                icon=folium.Icon(color='red', icon='home')
-            ).add_to(m)
-        
-        # Read the GeoJSON file
-        gdf = gpd.read_file('USA_Detailed_Water_Bodies.geojson')
-        
-        # Simplify the data before processing
-        gdf = simplify_geojson(gdf)
-        
-        # Check if the data has valid geometry
-        if not gdf.geometry.is_valid.all():
-            st.toast('Fixing invalid geometries...', icon='🔧')
-            gdf.geometry = gdf.geometry.buffer(0)
-            time.sleep(3)
-        
-        # Check and reproject if necessary to WGS84 (EPSG:4326)
-        if gdf.crs != 'EPSG:4326':
-            gdf = gdf.to_crs(epsg=4326)
-        
-        if g.ok:
-            point_gdf = gpd.GeoDataFrame(geometry=[Point(g.lng, g.lat)], crs="EPSG:4326")
-            utm_zone = int((g.lng + 180) / 6) + 1
-            utm_crs = f"EPSG:269{utm_zone}" if g.lat >= 0 else f"EPSG:327{utm_zone}"
-            point_utm = point_gdf.to_crs(utm_crs)
-            gdf_utm = gdf.to_crs(utm_crs)
-            gdf_utm['distance'] = gdf_utm.geometry.distance(point_utm.geometry.iloc[0])
-            nearest_bodies = gdf_utm.nsmallest(5, 'distance')
+            candidates = candidates_stage(source_hash, g.lng, g.lat)
+            centroids, routes, route_errors = routes_stage(g.lng, g.lat, candidates)
+            for message in set(route_errors.values()):
+                st.warning(f"Could not get route details: {message}")
+            
+            supply_metrics = metrics_stage(candidates, centroids, routes, tank_capacity, fill_time)
             
-            supply_metrics = []
-            for _, row in nearest_bodies.to_crs("EPSG:4326").iterrows():
-                centroid = row.geometry.centroid
-                duration_minutes, distance_miles, route_coords = get_route_details(
-                    ors_client, [g.lng, g.lat], [centroid.x, centroid.y]
+            if supply_metrics and trucks > 1:
+                shuttle_plan = pipeline.shuttle_plan_for(
+                    supply_metrics, trucks, tank_capacity, fill_time, fill_slots=FILL_SITE_SLOTS
                 )
+                col3.metric(
+                    "Shuttle Flow Rate",
+                    f"{shuttle_plan['total_flow']:.0f} GPM",
+                    help="Sustained flow with the trucks spread over the best water sources"
+                )
+                st.dataframe(pd.DataFrame([{
+                    'Water Source': source['metric']['row']['NAME'],
+                    'Trucks': source['trucks'],
+                    'Round Trip (min)': round(source['metric']['round_trip']),
+                    'Flow Rate (GPM)': round(source['flow_rate']),
+                } for source in shuttle_plan['sources']]), hide_index=True)
+                if shuttle_plan['trucks_used'] < trucks:
+                    st.caption(f"{trucks - shuttle_plan['trucks_used']} trucks left unassigned: "
+                               "the fill sites are already saturated")
                 
-                if route_coords:
-                    # Calculate round trip time including fill time
-                    round_trip_minutes = (duration_minutes * 2) + fill_time
-                    
-                    # Calculate maximum sustainable flow rate
-                    max_flow_rate = tank_capacity / round_trip_minutes
-                    
-                    metrics = {
-                        'duration': duration_minutes,
-                        'distance': distance_miles,
-                        'round_trip': round_trip_minutes,
-                        'max_flow_rate': max_flow_rate,
-                        'route_coords': route_coords,
-                        'centroid': centroid,
-                        'row': row
-                    }
-                    supply_metrics.append(metrics)
-            
-            if supply_metrics:
-                # Find the highest sustainable flow rate
-                best_flow_rate = max(m['max_flow_rate'] for m in supply_metrics)
+                update_chat_context(address, tank_capacity, fill_time, supply_metrics, shuttle_plan)
+            elif supply_metrics:
+                # Metrics are sorted best first
+                best_flow_rate = supply_metrics[0]['max_flow_rate']
                 # Display the best flow rate in the third column
                 col3.metric(
                     "Sustainable Flow Rate", 
@@ -459,59 +658,23 @@ def main():
                 
                 # Update chat context with new information
                 update_chat_context(address, tank_capacity, fill_time, supply_metrics)
-                
-                # Sort metrics by max flow rate (higher is better)
-                supply_metrics.sort(key=lambda x: x['max_flow_rate'], reverse=True)
-                
-                # Add markers and routes
-                for idx, metric in enumerate(supply_metrics):
-                    normalized_score = idx / (len(supply_metrics) - 1) if len(supply_metrics) > 1 else 0
-                    if normalized_score < 0.5:
-                        # Green to Yellow (reversed from before - now green is best)
-                        green = 255
-                        red = int(normalized_score * 2 * 255)
-                        color = f'#{red:02x}{green:02x}00'
-                        marker_color = 'green'  # For the pin
-                    else:
-                        # Yellow to Red
-                        red = 255
-                        green = int((1 - normalized_score) * 2 * 255)
-                        color = f'#{red:02x}{green:02x}00'
-                        marker_color = 'red'  # For the pin
-                    
-                    # Add route with increased thickness
-                    folium.PolyLine(
-                        locations=metric['route_coords'],
-                        weight=6,
-                        color=color,
-                        opacity=0.8
-                    ).add_to(m)
-                    
-                    # Add marker with matching color
-                    folium.Marker(
-                        location=[metric['centroid'].y, metric['centroid'].x],
-                        popup=folium.Popup(
-                            f"Name: {metric['row']['NAME']}<br>"
-                            f"Type: {metric['row']['FTYPE']}<br>"
-                            f"Drive Distance: {metric['distance']:.1f} miles<br>"
-                            f"Round Trip Time: {metric['round_trip']:.0f} min<br>"
-                            f"Max Flow Rate: {metric['max_flow_rate']:.0f} GPM",
-                            max_width=300
-                        ),
-                        icon=folium.Icon(color=marker_color, icon='tint', prefix='fa')
-                    ).add_to(m)
+        
+        water_layer = water_layer_stage(source_hash, map_center[1], map_center[0], zoom_level)
+        m = map_stage(map_center, zoom_level, g, address, supply_metrics, water_layer)
         
         # Display the map
-        st_folium(m, width=1400, height=600)
+        st_folium(m, width=MAP_WIDTH, height=MAP_HEIGHT)
         
         # Clear loading toast when complete
         toast_placeholder.toast('Map loaded successfully!', icon='✅')
-        time.sleep(3)
         
     except Exception as e:
         error_message = f"Error loading data: {str(e)}"
         st.toast(error_message, icon='❌')
-        time.sleep(3)
+    
+    session_bytes = sessions.record_usage(st.session_state.chat_session_id, st.session_state.to_dict())
+    if PERF_DEBUG_PANEL or st.query_params.get('debug') == '1':
+        render_debug_panel(session_bytes)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,203 @@
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+from functools import lru_cache
+
+import shapely
+from shapely.geometry import box, mapping, shape
+
+import water_data
+
+TILE_DIR = os.path.join(water_data.CACHE_DIR, "tiles")
+TILE_SIZE = 256
+# Tiles are cut at these zooms; closer views reuse the deepest level
+MIN_TILE_ZOOM = 6
+MAX_TILE_ZOOM = 14
+TILE_PROPERTIES = ['NAME', 'FTYPE', 'FCODE_DESC']
+
+# Striped locks so two sessions don't build the same cold tile at once
+_tile_locks = [threading.Lock() for _ in range(64)]
+
+
+def tolerance_for_zoom(zoom):
+    """Simplification tolerance in degrees of about half a screen pixel at this zoom"""
+    return 360.0 / (TILE_SIZE * 2 ** zoom) / 2
+
+
+def tile_zoom_for(zoom):
+    return max(MIN_TILE_ZOOM, min(MAX_TILE_ZOOM, int(zoom)))
+
+
+def lnglat_to_pixel(lng, lat, zoom):
+    """Web Mercator world pixel coordinates"""
+    scale = TILE_SIZE * 2 ** zoom
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = (lng + 180.0) / 360.0 * scale
+    siny = math.sin(math.radians(lat))
+    y = (0.5 - math.log((1 + siny) / (1 - siny)) / (4 * math.pi)) * scale
+    return x, y
+
+
+def pixel_to_lnglat(x, y, zoom):
+    scale = TILE_SIZE * 2 ** zoom
+    lng = x / scale * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / scale))))
+    return lng, lat
+
+
+def tile_bounds(x, y, zoom):
+    """(min_lng, min_lat, max_lng, max_lat) of a slippy map tile"""
+    min_lng, max_lat = pixel_to_lnglat(x * TILE_SIZE, y * TILE_SIZE, zoom)
+    max_lng, min_lat = pixel_to_lnglat((x + 1) * TILE_SIZE, (y + 1) * TILE_SIZE, zoom)
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def tiles_for_bounds(bounds, zoom):
+    """Every (x, y) tile at zoom that overlaps a lon/lat bounding box"""
+    min_lng, min_lat, max_lng, max_lat = bounds
+    x0, y0 = lnglat_to_pixel(min_lng, max_lat, zoom)
+    x1, y1 = lnglat_to_pixel(max_lng, min_lat, zoom)
+    last = 2 ** zoom - 1
+    xs = range(max(0, int(x0 // TILE_SIZE)), min(last, int(x1 // TILE_SIZE)) + 1)
+    ys = range(max(0, int(y0 // TILE_SIZE)), min(last, int(y1 // TILE_SIZE)) + 1)
+    return [(x, y) for x in xs for y in ys]
+
+
+def viewport_bounds(lng, lat, zoom, width=1400, height=600):
+    """Lon/lat box visible in a width x height pixel map centered on (lng, lat)"""
+    cx, cy = lnglat_to_pixel(lng, lat, zoom)
+    min_lng, max_lat = pixel_to_lnglat(cx - width / 2, cy - height / 2, zoom)
+    max_lng, min_lat = pixel_to_lnglat(cx + width / 2, cy + height / 2, zoom)
+    return min_lng, min_lat, max_lng, max_lat
+
+
+class WaterTileStore:
+    """Zoom-dependent simplified, tile-clipped water body GeoJSON, cached on disk
+
+    Tiles are cut from the spatial index on first request (or ahead of time
+    with precompute()) and stored under TILE_DIR keyed by the source hash.
+    """
+
+    def __init__(self, index, source_hash):
+        self.index = index
+        self.directory = os.path.join(TILE_DIR, source_hash[:16])
+
+    def _tile_path(self, x, y, zoom):
+        return os.path.join(self.directory, str(zoom), str(x), f"{y}.geojson")
+
+    def _build_tile(self, x, y, zoom):
+        """GeoJSON features for one tile, each tagged with its source row id"""
+        bounds = tile_bounds(x, y, zoom)
+        ids = self.index.tree.query(box(*bounds))
+        if len(ids) == 0:
+            return []
+
+        # Skip bodies smaller than a pixel at this zoom; they can't be seen anyway
+        pixel = 2 * tolerance_for_zoom(zoom)
+        extents = shapely.bounds(self.index.gdf.geometry.values[ids])
+        visible = (extents[:, 2] - extents[:, 0] >= pixel) | (extents[:, 3] - extents[:, 1] >= pixel)
+        ids = ids[visible]
+
+        rows = self.index.gdf.iloc[ids]
+        geoms = shapely.clip_by_rect(rows.geometry.values, *bounds)
+        geoms = shapely.simplify(geoms, tolerance_for_zoom(zoom), preserve_topology=True)
+
+        features = []
+        for fid, geom, (_, row) in zip(ids, geoms, rows.iterrows()):
+            if geom.is_empty:
+                continue
+            features.append({
+                'type': 'Feature',
+                'id': int(fid),
+                'properties': {col: row[col] for col in TILE_PROPERTIES},
+                'geometry': mapping(geom),
+            })
+        return features
+
+    def tile(self, x, y, zoom):
+        """Features for a tile, reading from disk or building and saving it"""
+        return _load_tile(self, x, y, zoom)
+
+    def precompute(self, zooms):
+        """Write every non-empty tile at the given zooms; returns the number written"""
+        written = 0
+        for zoom in zooms:
+            tiles = set()
+            for geom in self.index.gdf.geometry.values:
+                tiles.update(tiles_for_bounds(geom.bounds, zoom))
+            for x, y in tiles:
+                if not os.path.exists(self._tile_path(x, y, zoom)):
+                    self._save(x, y, zoom, self._build_tile(x, y, zoom))
+                    written += 1
+        return written
+
+    def _save(self, x, y, zoom, features):
+        path = self._tile_path(x, y, zoom)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A unique temp file per writer, so concurrent writers (other sessions or
+        # a precompute run) never replace each other's half-written file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(features, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def viewport_geojson(self, lng, lat, zoom, width=1400, height=600):
+        """FeatureCollection for the visible map area only
+
+        Pieces of the same water body from neighbouring tiles are merged back
+        together so tile edges don't show up as seams, then clipped to the view.
+        """
+        bounds = viewport_bounds(lng, lat, zoom, width, height)
+        tile_zoom = tile_zoom_for(zoom)
+
+        pieces = {}
+        properties = {}
+        for x, y in tiles_for_bounds(bounds, tile_zoom):
+            for feature in self.tile(x, y, tile_zoom):
+                pieces.setdefault(feature['id'], []).append(shape(feature['geometry']))
+                properties[feature['id']] = feature['properties']
+
+        features = []
+        for fid, parts in pieces.items():
+            geom = parts[0] if len(parts) == 1 else shapely.union_all(parts)
+            geom = shapely.clip_by_rect(geom, *bounds)
+            if geom.is_empty:
+                continue
+            features.append({
+                'type': 'Feature',
+                'id': fid,
+                'properties': properties[fid],
+                'geometry': mapping(geom),
+            })
+        return {'type': 'FeatureCollection', 'features': features}
+
+
+@lru_cache(maxsize=1024)
+def _load_tile(store, x, y, zoom):
+    """In-memory LRU in front of the on-disk tiles"""
+    path = store._tile_path(x, y, zoom)
+    with _tile_locks[hash(path) % len(_tile_locks)]:
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        features = store._build_tile(x, y, zoom)
+        store._save(x, y, zoom, features)
+        return features
+
+
+if __name__ == "__main__":
+    # Usage: python map_tiles.py [min_zoom] [max_zoom]
+    import water_index
+
+    min_zoom = int(sys.argv[1]) if len(sys.argv) > 1 else MIN_TILE_ZOOM
+    max_zoom = int(sys.argv[2]) if len(sys.argv) > 2 else MAX_TILE_ZOOM
+    source_hash = water_data.file_hash(water_data.SOURCE_PATH)
+    store = WaterTileStore(water_index.WaterBodyIndex(water_data.load_water_bodies()), source_hash)
+    print(store.precompute(range(min_zoom, max_zoom + 1)))
@@ -0,0 +1,155 @@
+import os
+import re
+import sys
+
+import numpy as np
+
+import water_data
+
+MESH_DIR = os.path.join(water_data.CACHE_DIR, "meshes")
+# Triangle budgets for the prepared levels of detail, coarsest first
+LOD_TRIANGLES = [int(n) for n in os.getenv("STL_LOD_TRIANGLES", "20000,200000").split(',')]
+# Bisection steps when searching for the clustering grid size
+DECIMATE_ITERATIONS = 12
+
+STL_RECORD = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+VERTEX_PATTERN = re.compile(rb'vertex\s+(\S+)\s+(\S+)\s+(\S+)')
+
+
+def read_stl(path):
+    """Triangles of a binary or ASCII STL as a (T, 3, 3) float32 array"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    # Binary files may also start with "solid", so trust the size check first
+    if len(data) >= 84:
+        count = int(np.frombuffer(data, dtype='<u4', count=1, offset=80)[0])
+        if len(data) == 84 + count * STL_RECORD.itemsize:
+            return np.frombuffer(data, dtype=STL_RECORD, count=count, offset=84)['vertices'].copy()
+
+    coords = np.array(VERTEX_PATTERN.findall(data), dtype=np.float32)
+    if len(coords) == 0 or len(coords) % 3:
+        raise ValueError(f"Not a valid STL file: {path}")
+    return coords.reshape(-1, 3, 3)
+
+
+def deduplicate(triangles):
+    """Shared vertex list and (F, 3) faces, dropping faces that collapsed to a line or point"""
+    corners = np.ascontiguousarray(triangles.reshape(-1, 3), dtype=np.float32)
+    # Compare each vertex as one 12-byte value; much faster than unique(axis=0)
+    _, first, faces = np.unique(corners.view('V12').ravel(), return_index=True, return_inverse=True)
+    vertices = corners[first]
+    faces = faces.reshape(-1, 3)
+    return vertices, faces[non_degenerate(faces)]
+
+
+def non_degenerate(faces):
+    return (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+
+
+def cluster_vertices(vertices, faces, cell_size):
+    """Vertex-clustering decimation: merge all vertices in each grid cell into their mean"""
+    cells = np.floor((vertices - vertices.min(axis=0)) / cell_size).astype(np.int64)
+    # One integer key per cell so the grouping is a 1-D unique
+    dims = cells.max(axis=0) + 1
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    _, cluster, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    cluster = cluster.ravel()
+
+    merged = np.column_stack([
+        np.bincount(cluster, weights=vertices[:, axis], minlength=len(counts)) for axis in range(3)
+    ]) / counts[:, None]
+
+    faces = cluster[faces]
+    faces = faces[non_degenerate(faces)]
+    # Faces that now share the same three vertices collapse into one
+    faces = np.sort(faces, axis=1)
+    n = len(counts)
+    _, keep = np.unique((faces[:, 0] * n + faces[:, 1]) * n + faces[:, 2], return_index=True)
+    return merged.astype(np.float32), faces[np.sort(keep)]
+
+
+def decimate(vertices, faces, max_triangles):
+    """Vertex clustering on the finest grid that brings the mesh within max_triangles"""
+    if len(faces) <= max_triangles:
+        return vertices, faces
+    extent = float((vertices.max(axis=0) - vertices.min(axis=0)).max()) or 1.0
+
+    # Bisect the cell size, starting from a guess: a surface on a grid of n
+    # cells per side has on the order of n^2 faces
+    lo, hi = 0.0, extent
+    cell_size = extent / np.sqrt(max_triangles)
+    best = None
+    for _ in range(DECIMATE_ITERATIONS):
+        result = cluster_vertices(vertices, faces, cell_size)
+        if len(result[1]) <= max_triangles:
+            best, hi = result, cell_size
+        else:
+            lo = cell_size
+        cell_size = (lo + hi) / 2
+    return best if best is not None else cluster_vertices(vertices, faces, hi)
+
+
+def write_stl(path, vertices, faces):
+    """Write a binary STL with per-face normals"""
+    triangles = vertices[faces]
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    normals = np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+
+    records = np.zeros(len(faces), dtype=STL_RECORD)
+    records['normal'] = normals
+    records['vertices'] = triangles
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(b'Decimated by mesh_prep'.ljust(80, b'\0'))
+        f.write(np.uint32(len(faces)).tobytes())
+        f.write(records.tobytes())
+    os.replace(tmp_path, path)
+
+
+def lod_path(source_hash, name, max_triangles):
+    return os.path.join(MESH_DIR, f"{name}_{source_hash[:16]}_{max_triangles}.stl")
+
+
+def prepare_mesh(path, budgets=LOD_TRIANGLES, force=False):
+    """Build (or reuse) decimated copies of an STL; returns {budget: path}, coarsest first
+
+    Levels are cached on disk keyed by the file's hash. A budget at or above
+    the mesh's own triangle count just gets the deduplicated mesh, and
+    levels identical to the one before are left out.
+    """
+    source_hash = water_data.file_hash(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    paths = {budget: lod_path(source_hash, name, budget) for budget in sorted(budgets)}
+
+    if force or not all(os.path.exists(p) for p in paths.values()):
+        vertices, faces = deduplicate(read_stl(path))
+        for budget, out_path in paths.items():
+            if force or not os.path.exists(out_path):
+                write_stl(out_path, *decimate(vertices, faces, budget))
+
+    # Small meshes fit several budgets unchanged; offer each distinct level once
+    levels, previous = {}, None
+    for budget, out_path in paths.items():
+        count = triangle_count(out_path)
+        if count != previous:
+            levels[budget] = out_path
+        previous = count
+    return levels
+
+
+def triangle_count(path):
+    """Triangle count from a binary STL header, without reading the triangles"""
+    with open(path, 'rb') as f:
+        f.seek(80)
+        return int(np.frombuffer(f.read(4), dtype='<u4')[0])
+
+
+if __name__ == "__main__":
+    # Usage: python mesh_prep.py model.stl [budget ...]
+    budgets = [int(n) for n in sys.argv[2:]] or LOD_TRIANGLES
+    for budget, out_path in prepare_mesh(sys.argv[1], budgets, force=True).items():
+        print(budget, out_path, os.path.getsize(out_path))
@@ -0,0 +1,110 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+import numpy as np
+
+# JSON span logs: unset for none, "stderr", or a file path
+PERF_LOG = os.getenv("PERF_LOG", "")
+# Recent durations kept per span name for percentiles
+PERF_SAMPLES = int(os.getenv("PERF_SAMPLES", "500"))
+
+logger = logging.getLogger('perf')
+if PERF_LOG:
+    _handler = logging.StreamHandler() if PERF_LOG == 'stderr' else logging.FileHandler(PERF_LOG)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_lock = threading.Lock()
+_durations = {}          # span name -> deque of recent durations in ms
+_counts = {}             # span name -> (calls, errors)
+_recent = deque(maxlen=PERF_SAMPLES)
+_caches = {}             # cache name -> stats() callable
+
+
+@contextmanager
+def span(name, **tags):
+    """Time a block, record it under name and log it as one JSON line
+
+    Extra keyword tags (e.g. cached=True) go into the log record; tags can
+    also be added inside the block through the yielded dict.
+    """
+    start = time.perf_counter()
+    error = None
+    try:
+        yield tags
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        ms = (time.perf_counter() - start) * 1000
+        record = {'span': name, 'ms': round(ms, 2), 'ts': time.time(), **tags}
+        if error:
+            record['error'] = error
+        with _lock:
+            _durations.setdefault(name, deque(maxlen=PERF_SAMPLES)).append(ms)
+            calls, errors = _counts.get(name, (0, 0))
+            _counts[name] = (calls + 1, errors + bool(error))
+            _recent.append(record)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(record, default=str))
+
+
+def timed(name):
+    """Decorator form of span()"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_cache(name, stats):
+    """Expose a cache's stats() callable (hits/misses/...) under name"""
+    with _lock:
+        _caches[name] = stats
+
+
+def cache_stats():
+    with _lock:
+        caches = dict(_caches)
+    return {name: stats() for name, stats in caches.items()}
+
+
+def summary():
+    """Per-span call counts and latency percentiles over the recent samples"""
+    with _lock:
+        snapshot = {name: (np.array(d), _counts[name]) for name, d in _durations.items()}
+    return {
+        name: {
+            'calls': calls,
+            'errors': errors,
+            'last_ms': round(float(d[-1]), 2),
+            'p50_ms': round(float(np.percentile(d, 50)), 2),
+            'p95_ms': round(float(np.percentile(d, 95)), 2),
+            'max_ms': round(float(d.max()), 2),
+        }
+        for name, (d, (calls, errors)) in sorted(snapshot.items())
+    }
+
+
+def recent(limit=50):
+    """The latest span records, newest last"""
+    with _lock:
+        return list(_recent)[-limit:]
+
+
+def reset():
+    with _lock:
+        _durations.clear()
+        _counts.clear()
+        _recent.clear()
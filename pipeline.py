@@ -0,0 +1,87 @@
+import numpy as np
+
+import routing
+import shuttle_optimizer
+import water_index
+import water_metrics
+
+
+def find_candidates(gdf, index, isochrones, lng, lat, k=water_index.DEFAULT_K,
+                    max_distance=water_index.DEFAULT_MAX_DISTANCE_M):
+    """Candidate water bodies for a point
+
+    Uses the drive-time-ranked sources from the precomputed grid cell, which
+    carry the cell's estimated minutes in a drive_minutes column, falling back
+    to straight-line nearest outside the grid's coverage.
+    """
+    if isochrones is not None:
+        source_ids, minutes = isochrones.lookup(lng, lat)
+        if len(source_ids):
+            return gdf.iloc[source_ids[:k]].assign(drive_minutes=minutes[:k])
+    return index.nearest(lng, lat, k=k, max_distance=max_distance)
+
+
+def route_candidates(client, lng, lat, candidates, top_n=3):
+    """Drive time, distance and (for the top_n) route line to each candidate's centroid
+
+    Every candidate gets real drive time and distance from one matrix request.
+    Candidates from the drive-time grid were already picked by drive time, so
+    only the fastest one's line is fetched. Returns (centroids, routes, errors)
+    aligned with the candidate rows.
+    """
+    centroids = [geom.centroid for geom in candidates.geometry]
+    if 'drive_minutes' in candidates.columns:
+        top_n = 1
+    routes, errors = routing.route_water_sources(
+        client, [lng, lat], [[c.x, c.y] for c in centroids], top_n=top_n
+    )
+    return centroids, routes, errors
+
+
+def supply_metrics_for(candidates, centroids, routes, tank_capacity, fill_time):
+    """Per-source supply metrics for reachable candidates, best flow rate first"""
+    durations = np.array([route[0] if route else np.nan for route in routes])
+    distances = np.array([route[1] if route else np.nan for route in routes])
+
+    # Round trip and flow rate for every reachable source in one vectorized call
+    flows = water_metrics.scenario_matrix(durations, distances, tank_capacity, fill_time)
+
+    supply_metrics = []
+    for idx, ((_, row), centroid, route) in enumerate(zip(candidates.iterrows(), centroids, routes)):
+        if route is not None:
+            supply_metrics.append({
+                'duration': durations[idx],
+                'distance': distances[idx],
+                'round_trip': flows['round_trip'][0, idx],
+                'max_flow_rate': flows['max_flow_rate'][0, idx],
+                'route_coords': route[2],
+                'centroid': centroid,
+                'row': row
+            })
+
+    supply_metrics.sort(key=lambda x: x['max_flow_rate'], reverse=True)
+    return supply_metrics
+
+
+def shuttle_plan_for(supply_metrics, trucks, tank_capacity, fill_time, fill_slots=1):
+    """Spread a shuttle of identical trucks over the reachable sources
+
+    Returns the total sustained flow and, for each source that gets trucks,
+    its metrics entry with the number of trucks and the flow they deliver.
+    """
+    if not supply_metrics:
+        return None
+    plan = shuttle_optimizer.optimize_shuttle(
+        [metric['duration'] for metric in supply_metrics], tank_capacity, fill_time,
+        trucks=trucks, fill_slots=fill_slots
+    )
+    sources = [
+        {'metric': metric, 'trucks': int(plan['trucks_per_source'][idx]), 'flow_rate': plan['source_flow'][idx]}
+        for idx, metric in enumerate(supply_metrics) if plan['trucks_per_source'][idx]
+    ]
+    sources.sort(key=lambda source: source['flow_rate'], reverse=True)
+    return {
+        'total_flow': plan['total_flow'],
+        'trucks_used': int(plan['trucks_per_source'].sum()),
+        'sources': sources,
+    }
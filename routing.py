@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import perf
+from cache_store import PersistentCache, coord_key
+
+ORS_PROFILE = 'driving-car'
+METERS_TO_MILES = 0.000621371
+
+# ORS free tier allows 40 directions requests per minute
+ORS_REQUESTS_PER_MINUTE = int(os.getenv("ORS_REQUESTS_PER_MINUTE", "40"))
+ORS_MAX_WORKERS = int(os.getenv("ORS_MAX_WORKERS", "5"))
+ORS_REQUEST_TIMEOUT = float(os.getenv("ORS_REQUEST_TIMEOUT", "10"))
+# Road networks change slowly; a day keeps incident reruns off the API
+ROUTE_CACHE_TTL = float(os.getenv("ROUTE_CACHE_TTL", str(24 * 3600)))
+
+
+class RateLimiter:
+    """Thread-safe token bucket that spaces out requests to stay within a quota"""
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst if burst is not None else max(1, min(per_minute, ORS_MAX_WORKERS))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        """Block until a token is available; return False if the deadline passes first"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait_seconds = (1 - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait_seconds > deadline:
+                return False
+            time.sleep(wait_seconds)
+
+
+rate_limiter = RateLimiter(ORS_REQUESTS_PER_MINUTE)
+route_cache = PersistentCache('routes', ttl=ROUTE_CACHE_TTL)
+matrix_cache = PersistentCache('matrix', ttl=ROUTE_CACHE_TTL)
+perf.register_cache('routes', route_cache.stats)
+perf.register_cache('matrix', matrix_cache.stats)
+_executor = ThreadPoolExecutor(max_workers=ORS_MAX_WORKERS, thread_name_prefix='ors')
+
+
+def fetch_route(client, start_coords, end_coords, profile=ORS_PROFILE, timeout=ORS_REQUEST_TIMEOUT,
+                limiter=None, deadline=None):
+    """Request a single route and return (duration_minutes, distance_miles, route_coords)
+
+    Cached routes are returned without touching the API or the rate limiter.
+    Raises on any API or network error so callers can decide how to report it.
+    """
+    key = coord_key(profile, start_coords, end_coords)
+    cached = route_cache.get(key)
+    if cached is not None:
+        return tuple(cached)
+
+    if limiter and not limiter.acquire(deadline):
+        raise TimeoutError("ORS rate limit wait exceeded timeout")
+
+    with perf.span('ors.directions'):
+        routes = client.request(
+            f"/v2/directions/{profile}/geojson", {},
+            post_json={"coordinates": [start_coords, end_coords]},
+            requests_kwargs={"timeout": timeout}
+        )
+
+    # Extract duration (seconds) and distance (meters)
+    segment = routes['features'][0]['properties']['segments'][0]
+    duration_minutes = segment['duration'] / 60
+    distance_miles = segment['distance'] * METERS_TO_MILES
+
+    # Flip coordinates for folium (lat, lng)
+    route_coords = [[coord[1], coord[0]] for coord in routes['features'][0]['geometry']['coordinates']]
+
+    route_cache.set(key, [duration_minutes, distance_miles, route_coords])
+    return duration_minutes, distance_miles, route_coords
+
+
+def fetch_matrix(client, start_coords, destinations, profile=ORS_PROFILE, timeout=ORS_REQUEST_TIMEOUT):
+    """One matrix request for drive time and distance from start to every destination
+
+    Returns two lists aligned with destinations (minutes, miles); unreachable
+    destinations are None.
+    """
+    key = coord_key(profile, start_coords, *destinations)
+    cached = matrix_cache.get(key)
+    if cached is not None:
+        return cached[0], cached[1]
+
+    if not rate_limiter.acquire(time.monotonic() + timeout):
+        raise TimeoutError("ORS rate limit wait exceeded timeout")
+
+    with perf.span('ors.matrix', destinations=len(destinations)):
+        result = client.request(
+            f"/v2/matrix/{profile}/json", {},
+            post_json={
+                "locations": [start_coords] + list(destinations),
+                "sources": [0],
+                "destinations": list(range(1, len(destinations) + 1)),
+                "metrics": ["duration", "distance"],
+            },
+            requests_kwargs={"timeout": timeout}
+        )
+
+    durations = [d / 60 if d is not None else None for d in result['durations'][0]]
+    distances = [d * METERS_TO_MILES if d is not None else None for d in result['distances'][0]]
+    matrix_cache.set(key, [durations, distances])
+    return durations, distances
+
+
+def route_candidates(client, start_coords, destinations, profile=ORS_PROFILE,
+                     timeout=ORS_REQUEST_TIMEOUT, limiter=None):
+    """Route to every destination concurrently on the shared worker pool
+
+    Returns (results, errors): results is aligned with destinations and holds
+    (duration_minutes, distance_miles, route_coords) or None for failed routes;
+    errors maps the failed index to a message. Routes still pending when the
+    overall deadline passes are reported as timed out rather than awaited.
+    """
+    limiter = limiter or rate_limiter
+    results = [None] * len(destinations)
+    errors = {}
+    if not destinations:
+        return results, errors
+
+    # Every request gets its own timeout, plus time spent queued behind the pool
+    rounds = -(-len(destinations) // ORS_MAX_WORKERS)
+    deadline = time.monotonic() + timeout * rounds
+
+    def task(end_coords):
+        return fetch_route(client, start_coords, end_coords, profile, timeout, limiter, deadline)
+
+    futures = {_executor.submit(task, end): idx for idx, end in enumerate(destinations)}
+    done, pending = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+
+    for future in pending:
+        future.cancel()
+        errors[futures[future]] = "Timed out"
+    for future in done:
+        idx = futures[future]
+        try:
+            results[idx] = future.result()
+        except Exception as e:
+            errors[idx] = str(e) or type(e).__name__
+
+    return results, errors
+
+
+def route_water_sources(client, start_coords, destinations, top_n=3, profile=ORS_PROFILE,
+                        timeout=ORS_REQUEST_TIMEOUT):
+    """Rank destinations with one matrix call, then fetch geometry only for the fastest top_n
+
+    Falls back to routing every destination concurrently if the matrix call
+    fails. Returns (results, errors) in the same shape as route_candidates;
+    destinations outside top_n carry matrix duration/distance with no geometry.
+    """
+    try:
+        durations, distances = fetch_matrix(client, start_coords, destinations, profile, timeout)
+    except Exception:
+        return route_candidates(client, start_coords, destinations, profile, timeout)
+
+    results = [None] * len(destinations)
+    errors = {}
+    for idx, (duration, distance) in enumerate(zip(durations, distances)):
+        if duration is None or distance is None:
+            errors[idx] = "No route found"
+        else:
+            results[idx] = (duration, distance, None)
+
+    reachable = sorted((idx for idx, r in enumerate(results) if r), key=lambda i: results[i][0])
+    top = reachable[:top_n]
+    routed, route_errors = route_candidates(
+        client, start_coords, [destinations[i] for i in top], profile, timeout
+    )
+    for idx, route in zip(top, routed):
+        # Keep the matrix numbers if the detailed route failed; only the line is missing
+        if route:
+            results[idx] = route
+    for local_idx, message in route_errors.items():
+        errors.setdefault(top[local_idx], message)
+
+    return results, errors
@@ -0,0 +1,149 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+import water_data
+
+# Chat messages kept in memory per session (excluding the system message)
+CHAT_HISTORY_MAX = int(os.getenv("CHAT_HISTORY_MAX", "40"))
+# Older messages are appended here per session; empty to discard them instead
+CHAT_SPILL_DIR = os.getenv("CHAT_SPILL_DIR", os.path.join(water_data.CACHE_DIR, "sessions"))
+# Spilled messages shown per "load older" step in the chat pane
+CHAT_SPILL_PAGE = int(os.getenv("CHAT_SPILL_PAGE", "20"))
+# Sessions not seen for this long are dropped from the usage table and their spill files deleted
+SESSION_USAGE_TTL = float(os.getenv("SESSION_USAGE_TTL", "3600"))
+
+_usage = {}
+_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+def spill_path(session_id):
+    return os.path.join(CHAT_SPILL_DIR, f"{session_id}.jsonl")
+
+
+def trim_history(session_id, messages, max_messages=CHAT_HISTORY_MAX):
+    """Move the oldest chat messages out of memory, in place; returns how many moved
+
+    Trims to 3/4 of the limit so it happens every few turns rather than on
+    every message. The system message always stays. Moved messages are
+    appended to the session's spill file when CHAT_SPILL_DIR is set.
+    """
+    history = [i for i, msg in enumerate(messages) if msg["role"] != "system"]
+    if len(history) <= max_messages:
+        return 0
+    cut = len(history) - max_messages * 3 // 4
+    # Don't leave an answer without its question at the start of the history
+    while cut < len(history) and messages[history[cut]]["role"] == "assistant":
+        cut += 1
+    drop = set(history[:cut])
+
+    if CHAT_SPILL_DIR:
+        os.makedirs(CHAT_SPILL_DIR, exist_ok=True)
+        with open(spill_path(session_id), 'a') as f:
+            f.write(''.join(json.dumps(messages[i]) + '\n' for i in sorted(drop)))
+
+    messages[:] = [msg for i, msg in enumerate(messages) if i not in drop]
+    return len(drop)
+
+
+def spilled_messages(session_id, limit=None):
+    """Messages moved to disk for this session, oldest first
+
+    With limit, only the newest limit messages are returned (and parsed).
+    """
+    path = spill_path(session_id) if CHAT_SPILL_DIR else None
+    if not path or not os.path.exists(path):
+        return []
+    with open(path) as f:
+        lines = deque((line for line in f if line.strip()), maxlen=limit)
+    return [json.loads(line) for line in lines]
+
+
+def deep_sizeof(obj, seen=None, depth=0):
+    """Approximate bytes held by obj, counting shared objects once
+
+    Arrays and DataFrames report their buffers; containers and plain objects
+    are walked a few levels deep.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen or depth > 8:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if hasattr(obj, 'memory_usage') and hasattr(obj, 'columns'):
+        return int(obj.memory_usage(deep=True).sum())
+    if hasattr(obj, 'to_plotly_json'):
+        # Plotly figures: the trace data dominates
+        return sum(deep_sizeof(value, seen, depth + 1)
+                   for trace in obj.data for value in (trace.x, trace.y) if value is not None)
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen, depth + 1) + deep_sizeof(v, seen, depth + 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen, depth + 1) for item in obj)
+    elif hasattr(obj, '__dict__') and not isinstance(obj, type):
+        size += deep_sizeof(vars(obj), seen, depth + 1)
+    return size
+
+
+def record_usage(session_id, state):
+    """Measure a session's state (any mapping of key -> value) and remember it
+
+    Returns the per-key byte counts for this session.
+    """
+    seen = set()
+    by_key = {key: deep_sizeof(value, seen) for key, value in state.items()}
+    messages = state.get('messages') or []
+    now = time.time()
+    with _lock:
+        _usage[session_id] = {
+            'bytes': sum(by_key.values()),
+            'messages': len(messages),
+            'spilled': state.get('spilled_messages', 0),
+            'updated': now,
+        }
+        stale = [sid for sid, usage in _usage.items() if now - usage['updated'] > SESSION_USAGE_TTL]
+        for sid in stale:
+            del _usage[sid]
+    _expire_spill_files(stale, now)
+    return by_key
+
+
+def _expire_spill_files(stale, now):
+    """Delete the spill files of expired sessions
+
+    Once per TTL the whole directory is swept too, which catches files left
+    by sessions from before a restart; files of live sessions are kept.
+    """
+    global _last_sweep
+    if not CHAT_SPILL_DIR:
+        return
+    paths = [spill_path(sid) for sid in stale]
+    if now - _last_sweep > SESSION_USAGE_TTL and os.path.isdir(CHAT_SPILL_DIR):
+        _last_sweep = now
+        with _lock:
+            live = {f"{sid}.jsonl" for sid in _usage}
+        for entry in os.scandir(CHAT_SPILL_DIR):
+            if entry.name.endswith('.jsonl') and entry.name not in live \
+                    and now - entry.stat().st_mtime > SESSION_USAGE_TTL:
+                paths.append(entry.path)
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def session_usage():
+    """Latest measured memory per live session, largest first"""
+    with _lock:
+        return dict(sorted(_usage.items(), key=lambda item: -item[1]['bytes']))
@@ -0,0 +1,155 @@
+import numpy as np
+
+# Improvements smaller than this (GPM) don't count, so the search always terminates
+MIN_GAIN = 1e-6
+MAX_ROUNDS = 1000
+
+
+def _source_flow(supply, busy, slots, limits):
+    """Sustained GPM out of each source
+
+    supply is the sum of capacity / round_trip over its trucks, busy the sum of
+    fill_time / round_trip (how many trucks are filling at once on average).
+    Once busy exceeds the fill slots, trucks queue and the whole shuttle slows
+    proportionally; limits caps the fill site's own throughput.
+    """
+    return np.minimum(supply / np.maximum(1.0, busy / slots), limits)
+
+
+def optimize_shuttle(durations, tank_capacities, fill_times, trucks=None, fill_slots=1, source_limits=np.inf):
+    """Assign trucks to water sources to maximize sustained flow at the fireground
+
+    durations are one-way drive minutes per source (M,), NaN when unreachable.
+    tank_capacities and fill_times describe each truck (N,); scalars broadcast
+    to trucks identical trucks. fill_slots is how many trucks a source can
+    fill at once and source_limits its maximum GPM (M,); scalars broadcast.
+
+    Uses the same round trip (2 x drive + fill) and fill-site saturation as
+    water_metrics.scenario_matrix: with identical trucks at one source the
+    result equals its shuttle_flow_rate. Greedy marginal-gain moves build
+    the plan, then single moves and pairwise swaps improve it until no change
+    helps. Trucks whose addition would only slow a saturated site are left
+    unassigned (-1).
+    """
+    durations = np.asarray(durations, dtype=float)
+    n_sources = len(durations)
+    capacities = np.atleast_1d(np.asarray(tank_capacities, dtype=float))
+    fills = np.atleast_1d(np.asarray(fill_times, dtype=float))
+    if trucks is not None:
+        capacities = np.broadcast_to(capacities, (trucks,))
+        fills = np.broadcast_to(fills, (trucks,))
+    capacities, fills = np.broadcast_arrays(capacities, fills)
+    slots = np.broadcast_to(np.asarray(fill_slots, dtype=float), (n_sources,))
+    limits = np.broadcast_to(np.asarray(source_limits, dtype=float), (n_sources,))
+
+    # Per truck x source contributions to supply and fill-site load
+    round_trip = 2 * durations[None, :] + fills[:, None]
+    reachable = ~np.isnan(round_trip)
+    round_trip = np.where(reachable, round_trip, np.inf)
+    supply = capacities[:, None] / round_trip
+    busy = fills[:, None] / round_trip
+
+    n_trucks = len(capacities)
+    trucks_idx = np.arange(n_trucks)
+    assignment = np.full(n_trucks, -1)
+    if n_sources == 0 or n_trucks == 0:
+        # Nothing to assign: any trucks stay staged
+        return {
+            'assignment': assignment,
+            'truck_flow': np.zeros(n_trucks),
+            'source_flow': np.zeros(0),
+            'total_flow': 0.0,
+            'fill_utilization': np.zeros(0),
+            'trucks_per_source': np.zeros(0, dtype=int),
+            'rounds': 0,
+        }
+    total_supply = np.zeros(n_sources)
+    total_busy = np.zeros(n_sources)
+
+    def move(i, target):
+        source = assignment[i]
+        if source >= 0:
+            total_supply[source] -= supply[i, source]
+            total_busy[source] -= busy[i, source]
+        if target >= 0:
+            total_supply[target] += supply[i, target]
+            total_busy[target] += busy[i, target]
+        assignment[i] = target
+
+    rounds = 0
+    while rounds < MAX_ROUNDS:
+        rounds += 1
+        current = _source_flow(total_supply, total_busy, slots, limits)
+        assigned = assignment >= 0
+        home = np.where(assigned, assignment, 0)
+
+        # Change at each truck's current source if it leaves (zero for unassigned trucks)
+        left = _source_flow(total_supply[home] - supply[trucks_idx, home],
+                            total_busy[home] - busy[trucks_idx, home], slots[home], limits[home])
+        leave_gain = np.where(assigned, left - current[home], 0.0)
+
+        # Change at every source if each truck joins it: (N, M)
+        join_gain = _source_flow(total_supply + supply, total_busy + busy, slots, limits) - current
+        gains = np.where(reachable, leave_gain[:, None] + join_gain, -np.inf)
+        gains[assigned, home[assigned]] = -np.inf  # staying put is not a move
+        # Last column: send the truck back to staging
+        gains = np.column_stack([gains, np.where(assigned, leave_gain, -np.inf)])
+
+        i, j = np.unravel_index(np.argmax(gains), gains.shape)
+        if gains[i, j] > MIN_GAIN:
+            move(i, j if j < n_sources else -1)
+            continue
+
+        # No single move helps; try exchanging two trucks between sources (or staging)
+        best = _best_swap(assignment, reachable, supply, busy, total_supply, total_busy, slots, limits, current)
+        if best is None:
+            break
+        i, k = best
+        source_i, source_k = assignment[i], assignment[k]
+        move(i, -1)
+        move(k, source_i)
+        move(i, source_k)
+
+    source_flow = _source_flow(total_supply, total_busy, slots, limits)
+    # Each truck's share of its source's (possibly throttled) flow
+    scale = np.divide(source_flow, total_supply, out=np.zeros(n_sources), where=total_supply > 0)
+    home = np.maximum(assignment, 0)
+    truck_flow = np.where(assignment >= 0, supply[trucks_idx, home] * scale[home], 0.0)
+
+    return {
+        'assignment': assignment,
+        'truck_flow': truck_flow,
+        'source_flow': source_flow,
+        'total_flow': float(source_flow.sum()),
+        'fill_utilization': total_busy / slots,
+        'trucks_per_source': np.bincount(assignment[assignment >= 0], minlength=n_sources),
+        'rounds': rounds,
+    }
+
+
+def _best_swap(assignment, reachable, supply, busy, total_supply, total_busy, slots, limits, current):
+    """(i, k) of the best improving exchange of two trucks at different sources, or None
+
+    Staged trucks take part too, so a truck can replace a better-suited
+    staged one in a single step.
+    """
+    if (assignment >= 0).sum() == 0:
+        return None
+    i, k = np.meshgrid(np.arange(len(assignment)), np.arange(len(assignment)), indexing='ij')
+    pi, pk = assignment[i], assignment[k]
+    # Staging (-1) is handled by masking; index 0 just keeps the lookups valid
+    si, sk = np.maximum(pi, 0), np.maximum(pk, 0)
+
+    # Truck i leaves pi and takes truck k's place at pk, and vice versa
+    new_pi = _source_flow(total_supply[si] - supply[i, si] + supply[k, si],
+                          total_busy[si] - busy[i, si] + busy[k, si], slots[si], limits[si])
+    new_pk = _source_flow(total_supply[sk] - supply[k, sk] + supply[i, sk],
+                          total_busy[sk] - busy[k, sk] + busy[i, sk], slots[sk], limits[sk])
+    gains = np.where(pi >= 0, new_pi - current[si], 0.0) + np.where(pk >= 0, new_pk - current[sk], 0.0)
+    valid = (pi != pk) & ((pi < 0) | reachable[k, si]) & ((pk < 0) | reachable[i, sk])
+    gains = np.where(valid, gains, -np.inf)
+
+    a, b = np.unravel_index(np.argmax(gains), gains.shape)
+    if gains[a, b] <= MIN_GAIN:
+        return None
+    return a, b
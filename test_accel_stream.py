@@ -0,0 +1,38 @@
+import numpy as np
+
+import accel_stream
+
+
+def test_minmax_downsample_keeps_newest_samples():
+    times = np.arange(2999) * 0.002
+    values = np.zeros(2999)
+    values[-5] = 9.0
+
+    out_t, out_v = accel_stream.minmax_downsample(times, values, 1000)
+
+    # A flat signal has min == max in most bins; the newest sample must still show
+    assert out_t[-1] == times[-1]
+    assert out_v.max() == 9.0
+    assert np.all(np.diff(out_t) >= 0)
+
+
+def test_minmax_downsample_covers_oldest_samples():
+    times = np.arange(2999) * 0.002
+    values = np.zeros(2999)
+    values[3] = -7.0
+
+    out_t, out_v = accel_stream.minmax_downsample(times, values, 1000)
+
+    assert out_t[0] == times[0]
+    assert out_v.min() == -7.0
+
+
+def test_minmax_downsample_keeps_every_bin_extreme():
+    values = np.random.default_rng(0).normal(0, 0.1, 10007)
+    times = np.arange(len(values)) * 0.002
+
+    out_t, out_v = accel_stream.minmax_downsample(times, values, 1000)
+
+    assert len(out_t) <= 2 * 1000 + 1
+    assert out_v.max() == values.max() and out_v.min() == values.min()
+    assert np.all(np.diff(out_t) >= 0)
@@ -0,0 +1,83 @@
+import hashlib
+import os
+import sys
+
+import geopandas as gpd
+
+import perf
+
+SOURCE_PATH = 'USA_Detailed_Water_Bodies.geojson'
+CACHE_DIR = os.getenv("WATER_CACHE_DIR", ".cache")
+DEFAULT_TOLERANCE = 0.001
+ESSENTIAL_COLUMNS = ['NAME', 'FTYPE', 'FCODE_DESC', 'geometry']
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Hash a file's contents so cached artifacts are invalidated when it changes"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def simplify_geojson(gdf, tolerance=DEFAULT_TOLERANCE):
+    """Simplify geometries and remove unnecessary columns"""
+    # Keep only essential columns
+    gdf = gdf[ESSENTIAL_COLUMNS].copy()
+
+    # Simplify geometries
+    gdf['geometry'] = gdf['geometry'].simplify(tolerance=tolerance, preserve_topology=True)
+
+    return gdf
+
+
+def clean_water_bodies(gdf, tolerance=DEFAULT_TOLERANCE):
+    """Prune, simplify, repair and reproject a raw water body layer to WGS84"""
+    gdf = simplify_geojson(gdf, tolerance)
+
+    # Repair any geometries broken by the source data or by simplification
+    if not gdf.geometry.is_valid.all():
+        gdf.geometry = gdf.geometry.buffer(0)
+
+    if gdf.crs != 'EPSG:4326':
+        gdf = gdf.to_crs(epsg=4326)
+
+    return gdf.reset_index(drop=True)
+
+
+def cache_path(source_path=SOURCE_PATH, tolerance=DEFAULT_TOLERANCE):
+    """Location of the preprocessed layer for this source file and tolerance"""
+    key = f"{file_hash(source_path)[:16]}_{tolerance:g}"
+    name = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(CACHE_DIR, f"{name}_{key}.parquet")
+
+
+def prepare_water_bodies(source_path=SOURCE_PATH, tolerance=DEFAULT_TOLERANCE, force=False):
+    """One-time ingest: write the cleaned layer to GeoParquet and return its path"""
+    path = cache_path(source_path, tolerance)
+    if os.path.exists(path) and not force:
+        return path
+
+    gdf = clean_water_bodies(gpd.read_file(source_path), tolerance)
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Write to a temp file first so a crashed ingest never leaves a partial cache
+    tmp_path = f"{path}.tmp"
+    gdf.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_water_bodies(source_path=SOURCE_PATH, tolerance=DEFAULT_TOLERANCE):
+    """Load the preprocessed layer, running the ingest first if it is missing or stale"""
+    with perf.span('dataset.load'):
+        path = prepare_water_bodies(source_path, tolerance)
+        return gpd.read_parquet(path, memory_map=True)
+
+
+if __name__ == "__main__":
+    # Usage: python water_data.py [source.geojson] [tolerance]
+    source = sys.argv[1] if len(sys.argv) > 1 else SOURCE_PATH
+    tol = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_TOLERANCE
+    print(prepare_water_bodies(source, tol, force=True))
@@ -0,0 +1,159 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from pyproj import Transformer
+from shapely import STRtree
+from shapely.geometry import Point, box
+
+import perf
+
+DEFAULT_K = int(os.getenv("WATER_NEAREST_K", "5"))
+# Straight-line search radius in meters (0 disables the limit)
+DEFAULT_MAX_DISTANCE_M = float(os.getenv("WATER_MAX_DISTANCE_M", "50000"))
+# Number of per-zone projected geometry copies kept in memory
+PROJECTION_CACHE_SIZE = int(os.getenv("WATER_PROJECTION_CACHE_SIZE", "4"))
+
+# Meters per degree of latitude, and per degree of longitude at the equator
+M_PER_DEG_LAT = 110574.0
+M_PER_DEG_LON = 111320.0
+
+
+def utm_crs_for(lng, lat):
+    """UTM zone CRS used for metric distances around a point"""
+    utm_zone = int((lng + 180) / 6) + 1
+    return f"EPSG:269{utm_zone}" if lat >= 0 else f"EPSG:327{utm_zone}"
+
+
+def degree_box(lng, lat, radius_m):
+    """Lon/lat box that is guaranteed to contain every point within radius_m"""
+    # Pad by 1% to absorb UTM scale error relative to true ground distance
+    radius_m *= 1.01
+    dlat = radius_m / M_PER_DEG_LAT
+    # Use the latitude furthest from the equator so the box never undershoots
+    far_lat = min(abs(lat) + dlat, 89.9)
+    dlon = radius_m / (M_PER_DEG_LON * math.cos(math.radians(far_lat)))
+    return box(lng - dlon, lat - dlat, lng + dlon, lat + dlat)
+
+
+class ProjectionCache:
+    """Bounded LRU of a geometry column projected into each requested CRS"""
+
+    def __init__(self, geometry, max_entries=PROJECTION_CACHE_SIZE):
+        self.geometry = geometry
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._transformers = {}
+        self._lock = threading.Lock()
+
+    def get(self, crs):
+        """Projected copy of the geometry column, transforming the full table only on a miss"""
+        with self._lock:
+            if crs in self._entries:
+                self._entries.move_to_end(crs)
+                self.hits += 1
+                return self._entries[crs]
+            self.misses += 1
+
+        # Project outside the lock so other zones are not blocked on this one
+        with perf.span('reproject', crs=str(crs)):
+            projected = self.geometry.to_crs(crs)
+
+        with self._lock:
+            self._entries[crs] = projected
+            self._entries.move_to_end(crs)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return projected
+
+    def transformer(self, crs):
+        """Cached WGS84 -> crs transformer for projecting query points"""
+        with self._lock:
+            if crs not in self._transformers:
+                self._transformers[crs] = Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+            return self._transformers[crs]
+
+    def stats(self):
+        """Hit/miss counters for sizing the cache"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
+
+
+class WaterBodyIndex:
+    """STRtree over WGS84 water body geometries with exact k-nearest refinement"""
+
+    def __init__(self, gdf):
+        if gdf.crs is not None and gdf.crs != 'EPSG:4326':
+            gdf = gdf.to_crs(epsg=4326)
+        # Positional ids throughout; skip the copy when the index already matches
+        self.gdf = gdf if gdf.index.equals(pd.RangeIndex(len(gdf))) else gdf.reset_index(drop=True)
+        self.tree = STRtree(self.gdf.geometry.values)
+        self.projections = ProjectionCache(self.gdf.geometry)
+        perf.register_cache('projections', self.projections.stats)
+
+    def __len__(self):
+        return len(self.gdf)
+
+    def _distances(self, candidates, utm_crs, point_utm):
+        """Exact metric distances from the point to the candidate geometries"""
+        geoms = self.projections.get(utm_crs).iloc[candidates]
+        return geoms.distance(point_utm).to_numpy()
+
+    @perf.timed('nearest_search')
+    def nearest(self, lng, lat, k=DEFAULT_K, max_distance=DEFAULT_MAX_DISTANCE_M):
+        """Return the k nearest water bodies to (lng, lat) with a 'distance' column in meters"""
+        empty = self.gdf.iloc[[]].assign(distance=np.array([], dtype=float))
+        if len(self) == 0 or k <= 0:
+            return empty
+
+        utm_crs = utm_crs_for(lng, lat)
+        x, y = self.projections.transformer(utm_crs).transform(lng, lat)
+        point_utm = Point(x, y)
+        point = Point(lng, lat)
+
+        # Seed the search box from the single nearest geometry, then grow it until
+        # it holds at least k candidates (or hits the radius limit)
+        nearest_idx = self.tree.query_nearest(point)
+        seed = self._distances(nearest_idx, utm_crs, point_utm)
+        radius = max(float(seed.min()), 1.0)
+        if max_distance and radius > max_distance:
+            return empty
+
+        while True:
+            if max_distance:
+                radius = min(radius, max_distance)
+            candidates = self.tree.query(degree_box(lng, lat, radius))
+            if len(candidates) >= k or (max_distance and radius >= max_distance) \
+                    or len(candidates) == len(self):
+                break
+            radius *= 2
+
+        distances = self._distances(candidates, utm_crs, point_utm)
+
+        # A box holding k candidates can still miss closer geometries just outside
+        # it, so re-query with the k-th exact distance as the radius and refine again
+        kth = np.partition(distances, min(k, len(distances)) - 1)[min(k, len(distances)) - 1]
+        if kth > radius:
+            radius = min(kth, max_distance) if max_distance else kth
+            candidates = self.tree.query(degree_box(lng, lat, radius))
+            distances = self._distances(candidates, utm_crs, point_utm)
+
+        keep = distances <= max_distance if max_distance else np.ones(len(distances), dtype=bool)
+        candidates, distances = candidates[keep], distances[keep]
+        order = np.argsort(distances, kind='stable')[:k]
+
+        result = self.gdf.iloc[candidates[order]].copy()
+        result['distance'] = distances[order]
+        return result
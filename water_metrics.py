@@ -0,0 +1,52 @@
+import numpy as np
+
+
+def scenario_matrix(durations, distances, tank_capacities, fill_times, trucks=1, pump_rates=None):
+    """Water supply metrics for every apparatus x source x shuttle size in one call
+
+    durations and distances are one-way drive minutes and miles per source (S,).
+    tank_capacities and fill_times describe each apparatus (A,); scalars broadcast.
+    trucks is the number of identical trucks shuttling in rotation (R,).
+    pump_rates (gallons/minute) adds per-tank operating time and efficiency score.
+
+    Every returned array is indexed [apparatus, source] or [apparatus, source, rotation].
+    Unreachable sources (NaN duration) produce NaN metrics.
+    """
+    durations = np.asarray(durations, dtype=float)
+    distances = np.asarray(distances, dtype=float)
+    capacities = np.atleast_1d(np.asarray(tank_capacities, dtype=float))
+    fills = np.atleast_1d(np.asarray(fill_times, dtype=float))
+    capacities, fills = np.broadcast_arrays(capacities, fills)
+    trucks = np.atleast_1d(np.asarray(trucks, dtype=float))
+
+    # Round trip = drive there and back plus time to fill at the source
+    round_trip = 2 * durations[None, :] + fills[:, None]
+    max_flow_rate = capacities[:, None] / round_trip
+
+    # A shuttle of n trucks delivers n times as much, until the fill site is busy
+    # full time: one truck can be filled every fill_time minutes
+    fill_site_limit = (capacities / fills)[:, None, None]
+    shuttle_flow_rate = np.minimum(max_flow_rate[:, :, None] * trucks[None, None, :], fill_site_limit)
+
+    metrics = {
+        'round_trip': round_trip,
+        'round_trip_distance': np.broadcast_to(2 * distances[None, :], round_trip.shape),
+        'max_flow_rate': max_flow_rate,
+        'shuttle_flow_rate': shuttle_flow_rate,
+        # Trucks beyond this add nothing because the fill site is saturated
+        'trucks_to_saturate': np.ceil(round_trip / fills[:, None]),
+    }
+
+    if pump_rates is not None:
+        pump_rates = np.broadcast_to(np.asarray(pump_rates, dtype=float), capacities.shape)
+        operating_time = capacities / pump_rates
+        metrics['operating_time'] = np.broadcast_to(operating_time[:, None], round_trip.shape)
+        metrics['efficiency_score'] = round_trip / operating_time[:, None]
+
+    return metrics
+
+
+def best_sources(metrics, key='max_flow_rate'):
+    """Index of the best source for each apparatus (and rotation), ignoring unreachable ones"""
+    values = np.where(np.isnan(metrics[key]), -np.inf, metrics[key])
+    return np.argmax(values, axis=1)